@@ -1,12 +1,16 @@
+import hashlib
+import json
 import logging
+import os
 from collections import defaultdict
-from dataclasses import dataclass
-from typing import Dict, List, Tuple
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
 
 from onf_parser import Section
-from onf_parser.models import Coref, Sentence, SpeakerInformation
+from onf_parser.models import Sentence
 
 from pronto.consts import BOOKS_S2L, ONTONOTES_BLACKLIST
+from pronto.ontonotes_index import OntonotesVerseIndex, parse_ontonotes_speaker_info, split_verse_key, verse_key
 from pronto.reading import Book, Verse
 
 logger = logging.getLogger(__name__)
@@ -14,12 +18,49 @@ logger = logging.getLogger(__name__)
 
 @dataclass
 class AlignedVerse:
+    """
+    A Bible verse together with the OntoNotes sentences it was aligned to.
+
+    Everything that tasks derive from the OntoNotes sentences is computed once, when the verse is aligned,
+    and stored on the instance so that it is also kept when aligned verses are cached:
+
+    - `speaker_spans`: the parsed speaker information of each sentence, as `(book, start, stop)`
+    - `is_cross_verse`: True iff any OntoNotes sentence crosses over into neighboring verses
+    - `mentions`: the coreference annotations of every leaf
+    - `sense_annotations`: the PropBank annotations of every leaf
+    - `reference`: a human-readable reference, e.g. "Matthew 1:1"
+
+    These are plain slots rather than dataclass fields, so they are left out of comparisons and `repr`.
+    """
+
+    __slots__ = (
+        "book",
+        "chapter",
+        "verse_id",
+        "verse",
+        "ontonotes_sentences",
+        "speaker_spans",
+        "is_cross_verse",
+        "mentions",
+        "sense_annotations",
+        "reference",
+    )
     book: str
     chapter: int
     verse_id: int
     verse: Verse
     ontonotes_sentences: List[Sentence]
 
+    def __post_init__(self):
+        self.speaker_spans = [parse_ontonotes_speaker_info(s.speaker_information) for s in self.ontonotes_sentences]
+        self.is_cross_verse = any(
+            int(verse) != self.verse_id for _, start, stop in self.speaker_spans for _, verse, _ in start + stop
+        )
+        leaves = [leaf for sentence in self.ontonotes_sentences for leaf in sentence.leaves]
+        self.mentions = [leaf.coref for leaf in leaves if leaf.coref is not None]
+        self.sense_annotations = [leaf.prop for leaf in leaves if leaf.prop is not None]
+        self.reference = f"{self.book} {self.chapter}:{self.verse_id}"
+
     @property
     def is_one_to_one(self) -> bool:
         """
@@ -27,95 +68,216 @@ class AlignedVerse:
         """
         return len(self.ontonotes_sentences) == 1
 
-    @property
-    def is_cross_verse(self) -> bool:
-        """
-        True iff any OntoNotes sentence crosses over into neighboring verses
-        """
-        if hasattr(self, "__is_cross_verse"):
-            return self.__is_cross_verse
-        else:
-            for sentence in self.ontonotes_sentences:
-                _, start, stop = _parse_ontonotes_speaker_info(sentence.speaker_information)
-                for _, verse, _ in start + stop:
-                    verse = int(verse)
-                    if verse != self.verse_id:
-                        self.__is_cross_verse = True
-                        return True
-            self.__is_cross_verse = False
-            return False
 
-    @property
-    def mentions(self) -> List[Coref]:
-        mentions = []
-        for sentence in self.ontonotes_sentences:
-            for leaf in sentence.leaves:
-                if leaf.coref is not None:
-                    mentions.append(leaf.coref)
-        return mentions
+def index_ontonotes(ontonotes_data: List[Tuple[str, List[Section]]]) -> OntonotesVerseIndex:
+    return OntonotesVerseIndex.from_ontonotes(ontonotes_data)
 
-    @property
-    def reference(self):
-        return f"{self.book} {self.chapter}:{self.verse_id}"
-
-
-def _parse_ontonotes_time(s: str):
-    pieces = s.split(":")
-    pieces = [p.split("_") for p in pieces]
-    assert all(len(p) == 3 for p in pieces)
-    return pieces
-
-
-def _parse_ontonotes_speaker_info(info: SpeakerInformation):
-    book = info.name
-    start = _parse_ontonotes_time(info.start_time)
-    stop = _parse_ontonotes_time(info.stop_time)
-    return book, start, stop
-
-
-def _index_ontonotes(
-    ontonotes_data: List[Tuple[str, List[Section]]]
-) -> Dict[str, Dict[str, Dict[str, List[Sentence]]]]:
-    index = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
-    for filename, sections in ontonotes_data:
-        for section in sections:
-            for sentence in section.sentences:
-                if sentence.speaker_information is None:
-                    continue
-                book, start, stop = _parse_ontonotes_speaker_info(sentence.speaker_information)
-                book = book.replace("_", " ")
-                for chapter, verse, _ in start + stop:
-                    chapter = int(chapter)
-                    verse = int(verse)
-                    if (
-                        verse not in index[book][chapter].keys() or sentence not in index[book][chapter][verse]
-                    ) and not (book, chapter, verse) in ONTONOTES_BLACKLIST:
-                        index[book][chapter][verse].append(sentence)
 
-    return index
+_BLACKLISTED_KEYS = defaultdict(set)
+for _book, _chapter, _verse in ONTONOTES_BLACKLIST:
+    _BLACKLISTED_KEYS[_book].add(verse_key(_chapter, _verse))
+
+
+def _bible_book_name(book: Book) -> str:
+    return BOOKS_S2L[book.id] if book.id in BOOKS_S2L else book.id
 
 
-def _index_bible_data(bible_data: List[Book]) -> Dict[str, Dict[str, Dict[str, Verse]]]:
-    index = defaultdict(lambda: defaultdict(dict))
+def _has_alignable_verses(book: Book) -> bool:
+    name = _bible_book_name(book)
+    return any((name, c.id, v.id) not in ONTONOTES_BLACKLIST for c in book.chapters for v in c.verses)
+
+
+def _index_bible_data(bible_data: List[Book], books: Set[str]) -> Dict[str, Dict[int, Verse]]:
+    """
+    Map the long names of the given books to their verses, keyed by `verse_key(chapter, verse)`.
+    """
+    index = {}
     for book in bible_data:
-        book_id = BOOKS_S2L[book.id] if book.id in BOOKS_S2L else book.id
-        for chapter in book.chapters:
-            for verse in chapter.verses:
-                if (book_id, chapter.id, verse.id) not in ONTONOTES_BLACKLIST:
-                    index[book_id][chapter.id][verse.id] = verse
+        book_id = _bible_book_name(book)
+        if book_id not in books:
+            continue
+        # verse_key, inlined, since this runs for every verse of every Bible
+        verses = {chapter.id << 32 | verse.id: verse for chapter in book.chapters for verse in chapter.verses}
+        for key in _BLACKLISTED_KEYS.get(book_id, ()):
+            verses.pop(key, None)
+        index.setdefault(book_id, {}).update(verses)
     return index
 
 
 def align_verses(
     ontonotes_data: List[Tuple[str, List[Section]]], bible_data: List[Book], threshold: int
 ) -> List[AlignedVerse]:
-    ontonotes_verse_index = _index_ontonotes(ontonotes_data)
-    bible_verse_index = _index_bible_data(bible_data)
+    return align_verses_to_index(index_ontonotes(ontonotes_data), bible_data, threshold)
+
+
+@dataclass
+class BookAlignmentStats:
+    """
+    How one book of a Bible lined up with OntoNotes.
+    """
+
+    aligned: int = 0
+    # OntoNotes verses with no Bible verse to align to
+    missing_in_bible: int = 0
+    # Bible verses with no OntoNotes sentences, counted only in chapters which OntoNotes covers
+    missing_in_ontonotes: int = 0
+    chapters_missing_in_bible: List[int] = field(default_factory=list)
+    chapters_missing_in_ontonotes: List[int] = field(default_factory=list)
+
+    @property
+    def is_mismatched(self) -> bool:
+        return (
+            self.missing_in_bible > 0
+            or self.missing_in_ontonotes > 0
+            or len(self.chapters_missing_in_bible) > 0
+            or len(self.chapters_missing_in_ontonotes) > 0
+        )
+
+
+@dataclass
+class AlignmentStats:
+    """
+    A summary of how a Bible lined up with OntoNotes, by book.
+    """
+
+    books: Dict[str, BookAlignmentStats] = field(default_factory=dict)
+    # OntoNotes books which the Bible does not have
+    missing_books: List[str] = field(default_factory=list)
+    # books whose alignment was taken from an `AlignmentManifest`
+    reused_books: List[str] = field(default_factory=list)
+
+    @property
+    def aligned(self) -> int:
+        return sum(b.aligned for b in self.books.values())
 
-    bible_books = set(bible_verse_index.keys())
+    @property
+    def misses(self) -> int:
+        return sum(b.missing_in_bible for b in self.books.values())
+
+    def mismatch_report(self) -> str:
+        lines = []
+        for book, stats in self.books.items():
+            if stats.is_mismatched:
+                lines.append(
+                    f"  {book}: {stats.missing_in_bible} verses missing in Bible,"
+                    f" {stats.missing_in_ontonotes} missing in OntoNotes"
+                    + (
+                        f"; chapters missing in Bible: {stats.chapters_missing_in_bible}"
+                        if stats.chapters_missing_in_bible
+                        else ""
+                    )
+                    + (
+                        f"; chapters missing in OntoNotes: {stats.chapters_missing_in_ontonotes}"
+                        if stats.chapters_missing_in_ontonotes
+                        else ""
+                    )
+                )
+        return "\n".join(lines)
+
+
+def _align_book(
+    ontonotes_verses: Dict[int, List[int]], bible_verses: Dict[int, Verse]
+) -> Tuple[List[Tuple[int, int, List[int]]], BookAlignmentStats]:
+    """
+    Align one book by joining its OntoNotes and Bible verses on their verse keys, returning a (chapter, verse,
+    sentence ids) record for each aligned verse, in OntoNotes order, along with the book's statistics.
+    """
+    records = [(*split_verse_key(key), ids) for key, ids in ontonotes_verses.items() if key in bible_verses]
+    ontonotes_chapters = {key >> 32 for key in ontonotes_verses}
+    bible_chapters = {key >> 32 for key in bible_verses}
+    stats = BookAlignmentStats(
+        aligned=len(records),
+        missing_in_bible=len(ontonotes_verses) - len(records),
+        missing_in_ontonotes=sum(
+            1 for key in bible_verses if key >> 32 in ontonotes_chapters and key not in ontonotes_verses
+        ),
+        chapters_missing_in_bible=sorted(ontonotes_chapters - bible_chapters),
+        chapters_missing_in_ontonotes=sorted(bible_chapters - ontonotes_chapters),
+    )
+    return records, stats
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class AlignmentManifest:
+    """
+    A JSON record, kept between runs, of how each book of one Bible was aligned. A book whose content digest
+    (see `pronto.reading.book_digest`) and OntoNotes index are unchanged since the last run is not aligned
+    again but rebuilt from its records here.
+
+    Each save also lists, under "changed", the references of verses which were added, removed, or changed in
+    text or in aligned sentences since the previous save, so that later stages can tell what is new.
+    """
+
+    VERSION = 2
+
+    def __init__(self, path: str):
+        self.path = path
+        self.previous = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                previous = json.load(f)
+            if previous.get("version") == self.VERSION:
+                self.previous = previous
+
+    def reusable_book(self, book: str, digest: Optional[str], index_digest: str) -> Optional[dict]:
+        if digest is None or self.previous.get("ontonotes_index") != index_digest:
+            return None
+        entry = self.previous["books"].get(book)
+        return entry if entry is not None and entry["digest"] == digest else None
+
+    @staticmethod
+    def _verse_states(books: Dict[str, dict]) -> Dict[str, Tuple[str, List[int]]]:
+        return {
+            f"{book} {chapter}:{verse_id}": (text_hash, list(sentence_ids))
+            for book, entry in books.items()
+            for chapter, verse_id, text_hash, sentence_ids in entry["verses"]
+        }
+
+    def save(self, index_digest: str, books: Dict[str, dict]) -> List[str]:
+        previous_states = self._verse_states(self.previous.get("books", {}))
+        states = self._verse_states(books)
+        changed = [r for r, state in states.items() if previous_states.get(r) != state]
+        changed += [r for r in previous_states if r not in states]
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({"version": self.VERSION, "ontonotes_index": index_digest, "books": books, "changed": changed}, f)
+        os.replace(self.path + ".tmp", self.path)
+        return changed
+
+
+def align_verses_to_index(
+    ontonotes_verse_index: OntonotesVerseIndex,
+    bible_data: List[Book],
+    threshold: int,
+    manifest_path: Optional[str] = None,
+) -> List[AlignedVerse]:
+    return align_verses_to_index_with_stats(ontonotes_verse_index, bible_data, threshold, manifest_path)[0]
+
+
+def align_verses_to_index_with_stats(
+    ontonotes_verse_index: OntonotesVerseIndex,
+    bible_data: List[Book],
+    threshold: int,
+    manifest_path: Optional[str] = None,
+) -> Tuple[List[AlignedVerse], AlignmentStats]:
+    """
+    Like `align_verses`, but against an OntoNotes verse index that has already been built, so that many
+    Bibles can be aligned without re-indexing OntoNotes for each one. Also returns statistics on the chapters
+    and verses which did not line up; these are logged as a single report rather than per chapter.
+
+    If `manifest_path` is given, only books which changed since the last run with the same manifest are
+    aligned again; see `AlignmentManifest`.
+    """
+    bible_books = {_bible_book_name(b) for b in bible_data if _has_alignable_verses(b)}
     ontonotes_books = set(ontonotes_verse_index.keys())
     common_books = bible_books.intersection(ontonotes_books)
     only_ontonotes_books = ontonotes_books.difference(bible_books)
+    # only the books which OntoNotes covers need their verses indexed
+    bible_verse_index = _index_bible_data(bible_data, common_books)
 
     if len(only_ontonotes_books) > 0:
         logger.warning(
@@ -123,37 +285,46 @@ def align_verses(
             f" {only_ontonotes_books}.\n\nDoes this look right? Consider editing consts.py."
         )
 
+    manifest = AlignmentManifest(manifest_path) if manifest_path is not None else None
+    index_digest = ontonotes_verse_index.digest() if manifest is not None else None
+    book_digests = {BOOKS_S2L.get(b.id, b.id): b.digest for b in bible_data} if manifest is not None else None
+
     aligned = []
-    misses = []
+    stats = AlignmentStats(missing_books=sorted(only_ontonotes_books))
+    manifest_books = {}
     for book in common_books:
-        bible_chapters = bible_verse_index[book].keys()
-        ontonotes_chapters = ontonotes_verse_index[book].keys()
-        if bible_chapters != ontonotes_chapters:
-            logger.warning(f"Chapters do not match for {book}! Bible: {bible_chapters}; Onto: {ontonotes_chapters}")
-        for chapter in ontonotes_chapters:
-            bible_verses = bible_verse_index[book][chapter].keys()
-            ontonotes_verses = ontonotes_verse_index[book][chapter].keys()
-            if bible_verses != ontonotes_verses:
-                onto_diff = set(bible_verses).difference(set(ontonotes_verses))
-                bible_diff = set(ontonotes_verses).difference(set(bible_verses))
-                logger.warning(
-                    f"Verses do not match for {book} {chapter}!"
-                    + (f" Missing in OntoNotes: {onto_diff}" if len(onto_diff) > 0 else "")
-                    + (f" Missing in Bible: {bible_diff}" if len(bible_diff) > 0 else "")
-                )
-            for verse_id, verses in ontonotes_verse_index[book][chapter].items():
-                if (
-                    book in bible_verse_index
-                    and chapter in bible_verse_index[book]
-                    and verse_id in bible_verse_index[book][chapter]
-                ):
-                    aligned.append(
-                        AlignedVerse(book, chapter, verse_id, bible_verse_index[book][chapter][verse_id], verses)
-                    )
-                else:
-                    misses.append((chapter, book, verse_id))
+        bible_verses = bible_verse_index[book]
+        entry = manifest.reusable_book(book, book_digests[book], index_digest) if manifest is not None else None
+        if entry is not None:
+            records = [(chapter, verse_id, sentence_ids) for chapter, verse_id, _, sentence_ids in entry["verses"]]
+            book_stats = BookAlignmentStats(**entry["stats"])
+            stats.reused_books.append(book)
+        else:
+            records, book_stats = _align_book(ontonotes_verse_index.verses(book), bible_verses)
+        stats.books[book] = book_stats
+        for chapter, verse_id, sentence_ids in records:
+            sentences = ontonotes_verse_index.sentences(sentence_ids)
+            aligned.append(AlignedVerse(book, chapter, verse_id, bible_verses[verse_key(chapter, verse_id)], sentences))
+        if manifest is not None:
+            manifest_books[book] = {
+                "digest": book_digests[book],
+                "stats": asdict(book_stats),
+                "verses": [
+                    [chapter, verse_id, _text_hash(bible_verses[verse_key(chapter, verse_id)].body), list(ids)]
+                    for chapter, verse_id, ids in records
+                ],
+            }
 
-    logger.info(f"Aligned {len(aligned)} verses; failed to align {len(misses)} from OntoNotes verses")
+    mismatches = stats.mismatch_report()
+    if mismatches != "":
+        logger.warning(f"Chapters or verses do not match in some books:\n{mismatches}")
+    logger.info(f"Aligned {len(aligned)} verses; failed to align {stats.misses} from OntoNotes verses")
     if len(aligned) < threshold:
         raise ValueError(f"Aborting run due to insufficient aligned verse count: {len(aligned)}")
-    return aligned
+    if manifest is not None:
+        changed = manifest.save(index_digest, manifest_books)
+        logger.info(
+            f"Reused the alignments of {len(stats.reused_books)} unchanged books; {len(changed)} verse references"
+            f" changed since the last run (see {manifest_path})"
+        )
+    return aligned, stats
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import time
+from logging import getLogger
+from typing import List, Optional
+
+import numpy as np
+
+logger = getLogger(__name__)
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Pooled embeddings of texts, keyed by a hash of each text, for one encoder configuration. Texts are
+    independent of the task they come from, so tasks built from the same verses share embeddings.
+
+    Embeddings are appended in chunks: `<chunk>.npy` holds one embedding per row and is memory-mapped when
+    read, and `<chunk>.json` lists the hashes of the texts in its rows. A chunk's JSON file is written last,
+    so chunks left incomplete by an interrupted run are ignored.
+
+    Each hit refreshes its chunk's modification time. If `max_chunks` is set, `evict()` deletes the least
+    recently used chunks beyond it; otherwise the cache only grows, and can be cleared by deleting `path`.
+    """
+
+    def __init__(self, path: str, max_chunks: Optional[int] = None):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_chunks = max_chunks
+        self.hits = 0
+        self.misses = 0
+        self._names = []
+        self._chunks = []
+        self._rows = {}
+        for name in sorted(os.listdir(path)):
+            if name.endswith(".json"):
+                self._load_chunk(name[: -len(".json")])
+
+    def _load_chunk(self, chunk: str) -> None:
+        with open(os.path.join(self.path, chunk + ".json"), "r") as f:
+            hashes = json.load(f)
+        self._names.append(chunk)
+        self._chunks.append(np.load(os.path.join(self.path, chunk + ".npy"), mmap_mode="r"))
+        for row, h in enumerate(hashes):
+            self._rows.setdefault(h, (len(self._chunks) - 1, row))
+
+    def __len__(self):
+        return len(self._rows)
+
+    def missing(self, texts: List[str]) -> List[str]:
+        """
+        Return the distinct texts which have no cached embedding, counting hits and misses.
+        """
+        missing = []
+        used = set()
+        for text in dict.fromkeys(texts):
+            h = _text_hash(text)
+            if h in self._rows:
+                self.hits += 1
+                used.add(self._rows[h][0])
+            else:
+                self.misses += 1
+                missing.append(text)
+        for chunk in used:
+            os.utime(os.path.join(self.path, self._names[chunk] + ".json"))
+        return missing
+
+    def add(self, texts: List[str], embeddings: np.ndarray) -> None:
+        if len(texts) == 0:
+            return
+        chunk = f"{time.time_ns()}-{os.getpid()}"
+        with open(os.path.join(self.path, chunk + ".npy.tmp"), "wb") as f:
+            np.save(f, embeddings.astype(np.float32))
+        os.replace(os.path.join(self.path, chunk + ".npy.tmp"), os.path.join(self.path, chunk + ".npy"))
+        with open(os.path.join(self.path, chunk + ".json.tmp"), "w") as f:
+            json.dump([_text_hash(t) for t in texts], f)
+        os.replace(os.path.join(self.path, chunk + ".json.tmp"), os.path.join(self.path, chunk + ".json"))
+        self._load_chunk(chunk)
+
+    def get(self, texts: List[str]) -> np.ndarray:
+        """
+        Return the embeddings of `texts`, one row per text, all of which must be cached.
+        """
+        return np.stack([self._chunks[chunk][row] for chunk, row in (self._rows[_text_hash(t)] for t in texts)])
+
+    def evict(self) -> int:
+        """
+        Delete least recently used chunks until at most `max_chunks` remain, returning how many were deleted.
+        Embeddings already read through this object stay readable.
+        """
+        if self.max_chunks is None:
+            return 0
+        entries = [e for e in os.scandir(self.path) if e.name.endswith(".json")]
+        entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+        for entry in entries[self.max_chunks :]:
+            # the JSON file goes first, so that no chunk is left listing rows it no longer has
+            for suffix in [".json", ".npy"]:
+                try:
+                    os.remove(entry.path[: -len(".json")] + suffix)
+                except FileNotFoundError:
+                    pass
+        evicted = max(0, len(entries) - self.max_chunks)
+        if evicted > 0:
+            logger.info(f"Evicted {evicted} chunks from embedding cache {self.path}")
+        return evicted
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+from logging import getLogger
+from shutil import rmtree
+from typing import Optional
+
+import datasets
+
+logger = getLogger(__name__)
+
+# Bump when tokenization in `pronto.eval.sequence_classifier` changes, to invalidate cached datasets
+TOKENIZED_CACHE_VERSION = 1
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """
+    Identify a tokenizer by its class, name and vocabulary, including any tokens added to it.
+    """
+    import transformers
+
+    h = hashlib.sha256()
+    h.update(f"{transformers.__version__};{type(tokenizer).__name__};{tokenizer.name_or_path}".encode("utf-8"))
+    h.update(json.dumps(sorted(tokenizer.get_vocab().items()), ensure_ascii=False).encode("utf-8"))
+    return h.hexdigest()
+
+
+class TokenizedDatasetCache:
+    """
+    A directory of tokenized `DatasetDict`s, each saved as Arrow files under a key which should cover
+    everything tokenization depends on: the tokenizer's fingerprint, the maximum sequence length, any extra
+    tokens, and the untokenized data.
+
+    Each hit refreshes an entry's modification time. If `max_entries` is set, `evict()` deletes the least
+    recently used entries beyond it. Hit and miss counts accumulate over the life of the object.
+    """
+
+    def __init__(self, path: str, max_entries: Optional[int] = None):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(**parts) -> str:
+        parts = {"version": TOKENIZED_CACHE_VERSION, **parts}
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def _entries(self):
+        return [e for e in os.scandir(self.path) if e.is_dir() and ".tmp" not in e.name]
+
+    def get(self, key: str) -> Optional[datasets.DatasetDict]:
+        entry_path = os.path.join(self.path, key)
+        if not os.path.exists(entry_path):
+            self.misses += 1
+            return None
+        self.hits += 1
+        os.utime(entry_path)
+        return datasets.load_from_disk(entry_path)
+
+    def put(self, key: str, dataset_dict: datasets.DatasetDict) -> None:
+        entry_path = os.path.join(self.path, key)
+        tmp_path = f"{entry_path}.tmp{os.getpid()}"
+        dataset_dict.save_to_disk(tmp_path)
+        try:
+            os.replace(tmp_path, entry_path)
+        except OSError:
+            # another process stored the same entry first
+            rmtree(tmp_path)
+
+    def evict(self) -> int:
+        """
+        Delete least recently used entries until at most `max_entries` remain, returning how many were deleted.
+        """
+        if self.max_entries is None:
+            return 0
+        entries = sorted(self._entries(), key=lambda e: e.stat().st_mtime, reverse=True)
+        for entry in entries[self.max_entries :]:
+            rmtree(entry.path, ignore_errors=True)
+        evicted = max(0, len(entries) - self.max_entries)
+        if evicted > 0:
+            logger.info(f"Evicted {evicted} entries from tokenized dataset cache {self.path}")
+        return evicted
@@ -1,7 +1,24 @@
 import json
+import os
+import sqlite3
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from typing import List, Optional, Tuple
+
+import click
 
 from pronto.eval.sequence_classifier import evaluate_model
 
+# Parsed datasets are cached and shared by every model evaluated on the same task, and tokenized datasets by
+# every repeated trial with the same tokenizer
+CACHE_OPTIONS = {
+    "dataset_cache_dir": "data/cache/datasets",
+    "tokenized_cache_dir": "data/cache/tokenized",
+    "tokenized_cache_max_entries": 200,
+}
+
 MULTI_MODELS = ["bert-base-multilingual-cased", "xlm-roberta-base", "xlm-roberta-large"]
 MODELS = {
     "ind": ["lgessler/microbert-indonesian-m", "lgessler/microbert-indonesian-mx", "cahya/bert-base-indonesian-522M"],
@@ -41,16 +58,22 @@ MODELS = {
 }
 
 
-def run_sentence_mood(bible, model, task):
+def run_sentence_mood(bible, model, task, num_proc=12):
     if model in MULTI_MODELS:
         return evaluate_model(
-            model, f"output/{bible}/{task}", epochs=20, num_proc=12, batch_size=8, gradient_accumulation_steps=2
+            model,
+            f"output/{bible}/{task}",
+            epochs=20,
+            num_proc=num_proc,
+            **CACHE_OPTIONS,
+            batch_size=8,
+            gradient_accumulation_steps=2,
         )
     else:
-        return evaluate_model(model, f"output/{bible}/{task}", epochs=20, num_proc=12)
+        return evaluate_model(model, f"output/{bible}/{task}", epochs=20, num_proc=num_proc, **CACHE_OPTIONS)
 
 
-def run_nonpronominal_mention(bible, model, task):
+def run_nonpronominal_mention(bible, model, task, num_proc=12):
     if model in MULTI_MODELS:
         return evaluate_model(
             model,
@@ -58,26 +81,39 @@ def run_nonpronominal_mention(bible, model, task):
             epochs=10,
             integer_label=True,
             max_integer_label=3,
-            num_proc=12,
+            num_proc=num_proc,
+            **CACHE_OPTIONS,
             batch_size=8,
             gradient_accumulation_steps=2,
         )
     else:
         return evaluate_model(
-            model, f"output/{bible}/{task}", epochs=10, integer_label=True, max_integer_label=3, num_proc=12
+            model,
+            f"output/{bible}/{task}",
+            epochs=10,
+            integer_label=True,
+            max_integer_label=3,
+            num_proc=num_proc,
+            **CACHE_OPTIONS,
         )
 
 
-def run_proper_noun_subject(bible, model, task):
+def run_proper_noun_subject(bible, model, task, num_proc=12):
     if model in MULTI_MODELS:
         return evaluate_model(
-            model, f"output/{bible}/{task}", epochs=10, num_proc=12, batch_size=8, gradient_accumulation_steps=2
+            model,
+            f"output/{bible}/{task}",
+            epochs=10,
+            num_proc=num_proc,
+            **CACHE_OPTIONS,
+            batch_size=8,
+            gradient_accumulation_steps=2,
         )
     else:
-        return evaluate_model(model, f"output/{bible}/{task}", epochs=10, num_proc=12)
+        return evaluate_model(model, f"output/{bible}/{task}", epochs=10, num_proc=num_proc, **CACHE_OPTIONS)
 
 
-def run_same_sense(bible, model, task):
+def run_same_sense(bible, model, task, num_proc=12):
     if model in MULTI_MODELS:
         return evaluate_model(
             model,
@@ -87,7 +123,8 @@ def run_same_sense(bible, model, task):
             second_text_column_index=2,
             extra_input_column_index=0,
             label_column_index=3,
-            num_proc=12,
+            num_proc=num_proc,
+            **CACHE_OPTIONS,
             batch_size=8,
             gradient_accumulation_steps=2,
         )
@@ -100,11 +137,12 @@ def run_same_sense(bible, model, task):
             second_text_column_index=2,
             extra_input_column_index=0,
             label_column_index=3,
-            num_proc=12,
+            num_proc=num_proc,
+            **CACHE_OPTIONS,
         )
 
 
-def run_same_arg_count(bible, model, task):
+def run_same_arg_count(bible, model, task, num_proc=12):
     if model in MULTI_MODELS:
         return evaluate_model(
             model,
@@ -114,7 +152,8 @@ def run_same_arg_count(bible, model, task):
             second_text_column_index=2,
             extra_input_column_index=0,
             label_column_index=3,
-            num_proc=12,
+            num_proc=num_proc,
+            **CACHE_OPTIONS,
             batch_size=8,
             gradient_accumulation_steps=2,
         )
@@ -127,7 +166,8 @@ def run_same_arg_count(bible, model, task):
             second_text_column_index=2,
             extra_input_column_index=0,
             label_column_index=3,
-            num_proc=12,
+            num_proc=num_proc,
+            **CACHE_OPTIONS,
         )
 
 
@@ -140,14 +180,76 @@ TASKS = {
 }
 
 
-def run_trial(bible, model, task):
-    with open("results.tsv", "r") as f:
-        if "\t".join([bible, model, task]) in f.read():
-            return
+class ResultStore:
+    """
+    An SQLite table of finished trials, keyed by (bible, model, task), which any number of processes may read
+    while one of them records results.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=60)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "bible TEXT NOT NULL, model TEXT NOT NULL, task TEXT NOT NULL, accuracy REAL NOT NULL, "
+            "seconds REAL, finished_at REAL, PRIMARY KEY (bible, model, task))"
+        )
+
+    def __contains__(self, trial: Tuple[str, str, str]) -> bool:
+        row = self._connection.execute(
+            "SELECT 1 FROM results WHERE bible = ? AND model = ? AND task = ?", trial
+        ).fetchone()
+        return row is not None
+
+    def record(self, trial: Tuple[str, str, str], accuracy: float, seconds: Optional[float] = None) -> None:
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)", (*trial, accuracy, seconds, time.time())
+            )
+
+    def import_tsv(self, path: str) -> None:
+        """
+        Add the results of a `results.tsv` written by earlier runs, so that those trials are not run again.
+        """
+        with open(path, "r") as f:
+            rows = [line.rstrip("\n").split("\t") for line in f if line.strip() != ""]
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?, NULL, NULL)",
+                [(bible, model, task, float(accuracy)) for bible, model, task, accuracy in rows],
+            )
+
+    def export_tsv(self, path: str) -> None:
+        rows = self._connection.execute(
+            "SELECT bible, model, task, accuracy FROM results ORDER BY finished_at, rowid"
+        ).fetchall()
+        with open(path + ".tmp", "w") as f:
+            for bible, model, task, accuracy in rows:
+                f.write("\t".join([bible, model, task, str(accuracy)]) + "\n")
+        os.replace(path + ".tmp", path)
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+def trial_grid() -> List[Tuple[str, str, str]]:
+    trials = []
+    for bible, models in MODELS.items():
+        for task in TASKS.keys():
+            for model in models + MULTI_MODELS:
+                trials.append((bible, model, task))
+    return trials
+
+
+def run_trial(bible, model, task, num_proc=12):
+    """
+    Run one trial, write its predictions under `preds/`, and return its accuracy and duration in seconds.
+    """
     print(f"Running {bible}-{model}-{task}")
-    result = TASKS[task](bible, model, task)
-    with open("results.tsv", "a") as f:
-        f.write("\t".join([bible, model, task, str(result["accuracy"]["accuracy"])]) + "\n")
+    start = time.perf_counter()
+    result = TASKS[task](bible, model, task, num_proc)
+    seconds = time.perf_counter() - start
     with open(f"preds/{bible}-{model.replace('/', '_')}-{task}.json", "w") as f:
         predictions = result["predictions"]
         result["predictions"] = predictions.predictions.argmax(-1).tolist()
@@ -155,15 +257,87 @@ def run_trial(bible, model, task):
         result["metrics"] = predictions.metrics
         result["test_instances"] = [x for x in result["test_instances"]]
         f.write(json.dumps(result))
+    return result["accuracy"]["accuracy"], seconds
 
 
-def run():
-    for bible, models in MODELS.items():
-        for task in TASKS.keys():
-            for model in models:
-                run_trial(bible, model, task)
-            for model in MULTI_MODELS:
-                run_trial(bible, model, task)
+def _set_thread_environment(threads):
+    # Read by thread pools when they start, so this must happen before workers are spawned: a spawned worker
+    # imports this module, and with it torch, before its initializer runs. Workers, and the processes `datasets`
+    # starts, inherit the environment.
+    os.environ.update(OMP_NUM_THREADS=str(threads), MKL_NUM_THREADS=str(threads), TOKENIZERS_PARALLELISM="false")
+
+
+def _init_worker(threads):
+    import torch
+
+    torch.set_num_threads(threads)
+
+
+def _print_summary(durations: List[float], wall_seconds: float) -> None:
+    if len(durations) == 0:
+        print("No trials were run.")
+        return
+    print(
+        f"Ran {len(durations)} trials in {wall_seconds / 3600:.2f}h: {len(durations) / wall_seconds * 3600:.2f}"
+        f" trials/hour; per trial mean {statistics.mean(durations):.0f}s, median {statistics.median(durations):.0f}s,"
+        f" max {max(durations):.0f}s"
+    )
+
+
+@click.command()
+@click.option("--workers", default=1, type=int, help="Trials to run concurrently, each in its own process")
+@click.option(
+    "--threads-per-worker",
+    default=None,
+    type=int,
+    help="CPU threads for each worker's training and data processing. By default the CPUs are split evenly"
+    " between several workers, and a single worker uses library defaults with 12 data processes.",
+)
+@click.option("--store", "store_path", default="results.sqlite", help="SQLite database of finished trials")
+@click.option("--results-tsv", default="results.tsv", help="TSV of results, imported on start and rewritten at the end")
+def run(workers, threads_per_worker, store_path, results_tsv):
+    if threads_per_worker is None and workers > 1:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    store = ResultStore(store_path)
+    if os.path.exists(results_tsv):
+        store.import_tsv(results_tsv)
+    trials = [trial for trial in trial_grid() if trial not in store]
+    print(f"{len(trials)} trials to run with {workers} workers")
+
+    if threads_per_worker is not None:
+        _set_thread_environment(threads_per_worker)
+
+    durations = []
+    start = time.perf_counter()
+    try:
+        if workers == 1:
+            if threads_per_worker is not None:
+                _init_worker(threads_per_worker)
+            for trial in trials:
+                accuracy, seconds = run_trial(*trial, num_proc=threads_per_worker or 12)
+                store.record(trial, accuracy, seconds)
+                durations.append(seconds)
+        else:
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(threads_per_worker,),
+            ) as executor:
+                futures = {executor.submit(run_trial, *trial, num_proc=threads_per_worker): trial for trial in trials}
+                for future in as_completed(futures):
+                    trial = futures[future]
+                    try:
+                        accuracy, seconds = future.result()
+                    except Exception as e:
+                        print(f"Trial {'-'.join(trial)} failed: {e!r}")
+                        continue
+                    store.record(trial, accuracy, seconds)
+                    durations.append(seconds)
+    finally:
+        _print_summary(durations, time.perf_counter() - start)
+        store.export_tsv(results_tsv)
+        store.close()
 
 
 if __name__ == "__main__":
@@ -1,3 +1,5 @@
+import hashlib
+import json
 import os
 from logging import getLogger
 from shutil import rmtree
@@ -8,8 +10,11 @@ import datasets
 import evaluate
 import numpy as np
 from datasets import ClassLabel, Value
-from transformers import (AutoModelForSequenceClassification, AutoTokenizer, DataCollatorWithPadding, Trainer,
-                          TrainingArguments)
+from transformers import (AutoModel, AutoModelForSequenceClassification, AutoTokenizer, DataCollatorWithPadding,
+                          Trainer, TrainingArguments)
+
+from pronto.eval._embedding_cache import EmbeddingCache
+from pronto.eval._tokenized_cache import TokenizedDatasetCache, tokenizer_fingerprint
 
 logger = getLogger(__name__)
 
@@ -65,6 +70,141 @@ def construct_dataset_dict(
     return ddict
 
 
+# Bump when `construct_dataset_dict` changes what it produces, to invalidate cached datasets
+DATASET_CACHE_VERSION = 1
+
+
+def _column_config(
+    integer_label,
+    max_integer_label,
+    text_column_index,
+    label_column_index,
+    second_text_column_index,
+    extra_input_column_index,
+):
+    return {
+        "integer_label": integer_label,
+        "max_integer_label": max_integer_label,
+        "text_column_index": text_column_index,
+        "label_column_index": label_column_index,
+        "second_text_column_index": second_text_column_index,
+        "extra_input_column_index": extra_input_column_index,
+    }
+
+
+def _dataset_cache_key(tsv_base_path, config):
+    h = hashlib.sha256(json.dumps({"version": DATASET_CACHE_VERSION, **config}, sort_keys=True).encode("utf-8"))
+    for split in ["train", "dev", "test"]:
+        with open(f"{tsv_base_path}_{split}.tsv", "rb") as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
+
+
+def load_dataset_dict(
+    tsv_base_path,
+    integer_label,
+    max_integer_label,
+    text_column_index,
+    label_column_index,
+    second_text_column_index,
+    extra_input_column_index,
+    cache_dir=None,
+):
+    """
+    Like `construct_dataset_dict`, but if `cache_dir` is given, the parsed splits are saved there as Arrow
+    files, keyed by the TSVs' contents and the column configuration, and are memory-mapped from there on later
+    calls. Evaluating several models on the same TSVs then only parses them once.
+    """
+    config = _column_config(
+        integer_label,
+        max_integer_label,
+        text_column_index,
+        label_column_index,
+        second_text_column_index,
+        extra_input_column_index,
+    )
+    if cache_dir is None:
+        return construct_dataset_dict(tsv_base_path, **config)
+
+    key = _dataset_cache_key(tsv_base_path, config)
+    path = os.path.join(cache_dir, f"{tsv_base_path.replace(os.sep, '_')}__{key[:16]}")
+    if not os.path.exists(path):
+        logger.info(f"Caching parsed dataset for {tsv_base_path} at {path}")
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        construct_dataset_dict(tsv_base_path, **config).save_to_disk(tmp_path)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # another process cached the same dataset first
+            rmtree(tmp_path)
+    return datasets.load_from_disk(path)
+
+
+class PaddingCounter:
+    """
+    Wraps a data collator to count how many of the tokens in the batches it pads are real and how many are
+    padding.
+    """
+
+    def __init__(self, collator):
+        self.collator = collator
+        self.real = 0
+        self.padded = 0
+
+    def __call__(self, features):
+        batch = self.collator(features)
+        mask = batch["attention_mask"]
+        self.real += int(mask.sum())
+        self.padded += mask.numel()
+        return batch
+
+    def take(self):
+        """
+        Return the counts so far and reset them.
+        """
+        stats = {"real_tokens": self.real, "padded_tokens": self.padded}
+        stats["waste"] = 1 - self.real / self.padded if self.padded > 0 else 0.0
+        self.real = self.padded = 0
+        return stats
+
+
+class _PaddingCountingTrainer(Trainer):
+    """
+    A trainer which gives the dataloaders it builds for training, evaluation and prediction their own
+    `PaddingCounter`s around its data collator, in `self.padding` under "train", "dev" and "test".
+    """
+
+    def __init__(self, *args, data_collator, **kwargs):
+        super().__init__(*args, data_collator=data_collator, **kwargs)
+        self.padding = {split: PaddingCounter(data_collator) for split in ["train", "dev", "test"]}
+
+    def _dataloader(self, split, get_dataloader, *args):
+        # dataloaders keep the collator they were built with
+        collator = self.data_collator
+        self.data_collator = self.padding[split]
+        try:
+            return get_dataloader(*args)
+        finally:
+            self.data_collator = collator
+
+    def get_train_dataloader(self):
+        return self._dataloader("train", super().get_train_dataloader)
+
+    def get_eval_dataloader(self, eval_dataset=None):
+        return self._dataloader("dev", super().get_eval_dataloader, eval_dataset)
+
+    def get_test_dataloader(self, test_dataset):
+        return self._dataloader("test", super().get_test_dataloader, test_dataset)
+
+
+def _sorted_by_length(dataset):
+    """
+    Return `dataset` sorted by sequence length, along with the order which restores the original one.
+    """
+    order = np.argsort([len(x) for x in dataset["input_ids"]], kind="stable")
+    return dataset.select(order), np.argsort(order)
+
+
 def evaluate_model(
     model_name,
     tsv_base_path,
@@ -81,9 +221,13 @@ def evaluate_model(
     second_text_column_index=None,
     extra_input_column_index=None,
     max_sequence_length=512,
+    dataset_cache_dir=None,
+    tokenized_cache_dir=None,
+    tokenized_cache_max_entries=None,
+    group_by_length=False,
 ):
     tokenizer = AutoTokenizer.from_pretrained(model_name)
-    dataset_dict = construct_dataset_dict(
+    dataset_dict = load_dataset_dict(
         tsv_base_path,
         integer_label,
         max_integer_label,
@@ -91,6 +235,7 @@ def evaluate_model(
         label_column_index,
         second_text_column_index,
         extra_input_column_index,
+        cache_dir=dataset_cache_dir,
     )
     possible_labels = dataset_dict["train"].features["label"].names
     label2id = {v: i for i, v in enumerate(possible_labels)}
@@ -119,17 +264,62 @@ def evaluate_model(
             args.append(batch["text2"])
         tokenizer_outputs = tokenizer(*args, truncation=True, max_length=max_sequence_length)
         if extra_input_column_index is not None:
-            extra_ids = [tokenizer.vocab[extras[x]] for x in batch["extra"]]
+            extra_ids = [extra_vocab_ids[x] for x in batch["extra"]]
             for k, vs in tokenizer_outputs.items():
-                for i, v in enumerate(vs):
+                # the extra token goes at the end, replacing the last token of sequences at the maximum length
+                fill = extra_ids if k == "input_ids" else [1] * len(vs)
+                for v, x in zip(vs, fill):
                     if len(v) == max_sequence_length:
-                        v.pop(-1)
-                    v.append(extra_ids[i] if k == "input_ids" else 1)
+                        v[-1] = x
+                    else:
+                        v.append(x)
         return tokenizer_outputs
 
-    tokenized_dataset_dict = dataset_dict.map(tokenize, batched=True, batch_size=batch_size, num_proc=num_proc)
+    def tokenize_dataset_dict():
+        # kept in memory rather than written next to the cached dataset's files
+        return dataset_dict.map(tokenize, batched=True, batch_size=batch_size, num_proc=num_proc, keep_in_memory=True)
+
+    if extra_input_column_index is not None:
+        extra_vocab_ids = [tokenizer.vocab[x] for x in extras]
+    if tokenized_cache_dir is None:
+        tokenized_dataset_dict = tokenize_dataset_dict()
+    else:
+        cache = TokenizedDatasetCache(tokenized_cache_dir, tokenized_cache_max_entries)
+        key = cache.key(
+            tokenizer=tokenizer_fingerprint(tokenizer),
+            max_sequence_length=max_sequence_length,
+            extras=list(zip(extras, extra_vocab_ids)) if extra_input_column_index is not None else None,
+            data=_dataset_cache_key(
+                tsv_base_path,
+                _column_config(
+                    integer_label,
+                    max_integer_label,
+                    text_column_index,
+                    label_column_index,
+                    second_text_column_index,
+                    extra_input_column_index,
+                ),
+            ),
+        )
+        tokenized_dataset_dict = cache.get(key)
+        if tokenized_dataset_dict is None:
+            tokenized_dataset_dict = tokenize_dataset_dict()
+            cache.put(key, tokenized_dataset_dict)
+            cache.evict()
+        else:
+            logger.info(f"Using cached tokenization of {tsv_base_path} for {model_name}")
     collator = DataCollatorWithPadding(tokenizer=tokenizer, return_tensors="pt")
 
+    train_dataset = tokenized_dataset_dict["train"]
+    dev_dataset = tokenized_dataset_dict["dev"]
+    test_dataset = tokenized_dataset_dict["test"]
+    if group_by_length:
+        # the trainer batches training examples of similar length together, and prediction sees examples in
+        # order of length, so that batches are padded as little as possible
+        train_dataset = train_dataset.add_column("length", [len(x) for x in train_dataset["input_ids"]])
+        dev_dataset, _ = _sorted_by_length(dev_dataset)
+        test_dataset, test_restore_order = _sorted_by_length(test_dataset)
+
     accuracy = evaluate.load("accuracy")
 
     def compute_metrics(eval_pred):
@@ -153,26 +343,164 @@ def evaluate_model(
         evaluation_strategy="epoch",
         save_strategy="epoch",
         load_best_model_at_end=True,
+        group_by_length=group_by_length,
     )
 
-    trainer = Trainer(
+    trainer = _PaddingCountingTrainer(
         model=model,
         args=training_args,
-        train_dataset=tokenized_dataset_dict["train"],
-        eval_dataset=tokenized_dataset_dict["dev"],
+        train_dataset=train_dataset,
+        eval_dataset=dev_dataset,
         tokenizer=tokenizer,
         data_collator=collator,
         compute_metrics=compute_metrics,
     )
     trainer.train()
-
-    predictions = trainer.predict(tokenized_dataset_dict["test"])
+    predictions = trainer.predict(test_dataset)
+    padding = {split: counter.take() for split, counter in trainer.padding.items()}
+    if group_by_length:
+        predictions = predictions._replace(
+            predictions=predictions.predictions[test_restore_order], label_ids=predictions.label_ids[test_restore_order]
+        )
+    logger.info("Padding waste: " + ", ".join(f"{k} {v['waste']:.1%}" for k, v in padding.items()))
     test_acc = accuracy.compute(
         predictions=predictions.predictions.argmax(-1), references=tokenized_dataset_dict["test"]["label"]
     )
     if temp_dir:
         rmtree(output_dir)
-    return {"accuracy": test_acc, "predictions": predictions, "test_instances": tokenized_dataset_dict["test"]}
+    return {
+        "accuracy": test_acc,
+        "predictions": predictions,
+        "test_instances": tokenized_dataset_dict["test"],
+        "padding": padding,
+    }
+
+
+def embed_texts(model_name, texts, batch_size=32, max_sequence_length=512):
+    """
+    Mean-pool the final hidden states of `model_name` over each text's tokens, returning one row per text.
+    """
+    import torch
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    embeddings = np.zeros((len(texts), model.config.hidden_size), dtype=np.float32)
+    # texts of similar length are batched together to keep padding low
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    with torch.no_grad():
+        for i in range(0, len(order), batch_size):
+            rows = order[i : i + batch_size]
+            inputs = tokenizer(
+                [texts[j] for j in rows],
+                truncation=True,
+                max_length=max_sequence_length,
+                padding=True,
+                return_tensors="pt",
+            )
+            hidden = model(**inputs).last_hidden_state
+            mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            embeddings[rows] = ((hidden * mask).sum(1) / mask.sum(1).clamp(min=1)).numpy()
+    return embeddings
+
+
+def _probe_features(dataset, embed, use_text2, extra_count):
+    first = embed(dataset["text"])
+    if use_text2:
+        second = embed(dataset["text2"])
+        features = np.hstack([first, second, first * second, np.abs(first - second)])
+    else:
+        features = first
+    if extra_count is None:
+        return features
+    return np.hstack([features, np.eye(extra_count, dtype=features.dtype)[dataset["extra"]]])
+
+
+def probe_model(
+    model_name,
+    tsv_base_path,
+    integer_label=False,
+    max_integer_label=None,
+    batch_size=32,
+    text_column_index=0,
+    label_column_index=1,
+    second_text_column_index=None,
+    extra_input_column_index=None,
+    max_sequence_length=512,
+    dataset_cache_dir=None,
+    embedding_cache_dir=None,
+    embedding_cache_max_chunks=None,
+    regularization=(0.01, 0.1, 1.0, 10.0),
+):
+    """
+    Evaluate a frozen encoder: embed each distinct text once, and train a logistic regression classifier on
+    the embeddings, choosing its inverse regularization strength from `regularization` by dev accuracy. For
+    text pairs, the classifier sees both embeddings along with their product and absolute difference; an
+    extra input column, if any, is added as a one-hot feature.
+
+    If `embedding_cache_dir` is given, embeddings are cached there by model and text, so that they are shared
+    by every task built from the same verses, keeping up to `embedding_cache_max_chunks` chunks per model.
+    """
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    dataset_dict = load_dataset_dict(
+        tsv_base_path,
+        integer_label,
+        max_integer_label,
+        text_column_index,
+        label_column_index,
+        second_text_column_index,
+        extra_input_column_index,
+        cache_dir=dataset_cache_dir,
+    )
+    columns = ["text"] + (["text2"] if second_text_column_index is not None else [])
+    texts = list(dict.fromkeys(t for split in dataset_dict.values() for c in columns for t in split[c]))
+
+    if embedding_cache_dir is None:
+        by_text = dict(zip(texts, embed_texts(model_name, texts, batch_size, max_sequence_length)))
+
+        def embed(xs):
+            return np.stack([by_text[x] for x in xs])
+
+    else:
+        cache = EmbeddingCache(
+            os.path.join(embedding_cache_dir, f"{model_name.replace('/', '_')}__mean__{max_sequence_length}"),
+            embedding_cache_max_chunks,
+        )
+        missing = cache.missing(texts)
+        logger.info(f"Embedding cache: {cache.hits} hits, {cache.misses} misses")
+        if len(missing) > 0:
+            cache.add(missing, embed_texts(model_name, missing, batch_size, max_sequence_length))
+        embed = cache.get
+
+    extra_count = len(dataset_dict["train"].features["extra"].names) if extra_input_column_index is not None else None
+    features = {
+        split: _probe_features(dataset, embed, second_text_column_index is not None, extra_count)
+        for split, dataset in dataset_dict.items()
+    }
+    if embedding_cache_dir is not None:
+        cache.evict()
+    labels = {split: np.array(dataset["label"]) for split, dataset in dataset_dict.items()}
+
+    best = None
+    for c in regularization:
+        classifier = make_pipeline(StandardScaler(), LogisticRegression(C=c, max_iter=2000))
+        classifier.fit(features["train"], labels["train"])
+        dev_accuracy = float((classifier.predict(features["dev"]) == labels["dev"]).mean())
+        if best is None or dev_accuracy > best[0]:
+            best = (dev_accuracy, c, classifier)
+    dev_accuracy, c, classifier = best
+
+    predictions = classifier.predict(features["test"])
+    return {
+        "accuracy": {"accuracy": float((predictions == labels["test"]).mean())},
+        "dev_accuracy": dev_accuracy,
+        "regularization": c,
+        "predictions": predictions.tolist(),
+        "gold_label_ids": labels["test"].tolist(),
+        "test_instances": dataset_dict["test"],
+    }
 
 
 @click.command
@@ -201,6 +529,39 @@ def evaluate_model(
 )
 @click.option("--extra-input-column-index", default=None, type=int, help="See use in code")
 @click.option("--max-sequence-length", default=512, type=int)
+@click.option(
+    "--dataset-cache-dir",
+    default=None,
+    help="Directory in which to cache parsed datasets as Arrow files, for reuse across runs",
+)
+@click.option(
+    "--tokenized-cache-dir",
+    default=None,
+    help="Directory in which to cache tokenized datasets, for reuse across runs with the same tokenizer",
+)
+@click.option(
+    "--tokenized-cache-max-entries",
+    default=None,
+    type=int,
+    help="Number of tokenized datasets to keep cached, evicting the least recently used",
+)
+@click.option(
+    "--group-by-length/--no-group-by-length",
+    default=False,
+    help="Batch examples of similar length together to reduce padding",
+)
+@click.option(
+    "--probe/--no-probe",
+    default=False,
+    help="Instead of fine-tuning, train a linear classifier on frozen, mean-pooled embeddings (see probe_model)",
+)
+@click.option("--embedding-cache-dir", default=None, help="Directory in which to cache embeddings for probing")
+@click.option(
+    "--embedding-cache-max-chunks",
+    default=None,
+    type=int,
+    help="Number of embedding chunks to keep cached per model, evicting the least recently used",
+)
 def run(
     model_name,
     tsv_base_path,
@@ -217,8 +578,36 @@ def run(
     second_text_column_index,
     extra_input_column_index,
     max_sequence_length,
+    dataset_cache_dir,
+    tokenized_cache_dir,
+    tokenized_cache_max_entries,
+    group_by_length,
+    probe,
+    embedding_cache_dir,
+    embedding_cache_max_chunks,
 ):
-    print(evaluate_model(**locals()))
+    if probe:
+        print(
+            probe_model(
+                model_name,
+                tsv_base_path,
+                integer_label=integer_label,
+                max_integer_label=max_integer_label,
+                batch_size=batch_size,
+                text_column_index=text_column_index,
+                label_column_index=label_column_index,
+                second_text_column_index=second_text_column_index,
+                extra_input_column_index=extra_input_column_index,
+                max_sequence_length=max_sequence_length,
+                dataset_cache_dir=dataset_cache_dir,
+                embedding_cache_dir=embedding_cache_dir,
+                embedding_cache_max_chunks=embedding_cache_max_chunks,
+            )
+        )
+    else:
+        kwargs = dict(locals())
+        del kwargs["probe"], kwargs["embedding_cache_dir"], kwargs["embedding_cache_max_chunks"]
+        print(evaluate_model(**kwargs))
 
 
 if __name__ == "__main__":
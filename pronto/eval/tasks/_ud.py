@@ -0,0 +1,188 @@
+from functools import lru_cache
+from logging import getLogger
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from tango import Format
+from tango.common import PathOrStr
+
+from pronto.aligning import AlignedVerse
+from pronto.eval.tasks._ud_cache import Parse, UdParseCache, stanza_model_key
+from pronto.tasks._util import DEFAULT_SPLIT_RATIOS
+from pronto.tasks.spec import StreamingTaskSpec
+from pronto.tasks.writers import RowWriter
+
+logger = getLogger(__name__)
+
+CONLLU_FIELDS = ["id", "text", "lemma", "upos", "xpos", "feats", "head", "deprel", "deps", "misc"]
+
+
+@lru_cache(maxsize=None)
+def get_pipeline(language: str):
+    from stanza import Pipeline
+
+    return Pipeline(lang=language)
+
+
+class UdParses:
+    """
+    UD parses of a Bible's verses, keyed by verse reference.
+    """
+
+    def __init__(self, language: str, parses: Dict[str, Parse]):
+        self.language = language
+        self.parses = parses
+
+    def __getitem__(self, verse: AlignedVerse) -> Parse:
+        return self.parses[verse.reference]
+
+    def __contains__(self, verse: AlignedVerse) -> bool:
+        return verse.reference in self.parses
+
+    def __len__(self):
+        return len(self.parses)
+
+
+def verses_to_parse(verses: List[AlignedVerse]) -> List[AlignedVerse]:
+    # Every UD-based task skips verses whose OntoNotes sentences cross verse boundaries
+    return [v for v in verses if not v.is_cross_verse]
+
+
+def parse_texts(texts: List[str], language: str, batch_size: int) -> List[Parse]:
+    """
+    Parse texts with stanza, handing it `batch_size` documents at a time.
+    """
+    pipeline = get_pipeline(language)
+    parses = []
+    for i in range(0, len(texts), batch_size):
+        parses.extend(doc.to_dict() for doc in pipeline.bulk_process(texts[i : i + batch_size]))
+        logger.info(f"Parsed {len(parses)} of {len(texts)} verses")
+    return parses
+
+
+def parse_verses(
+    verses: List[AlignedVerse],
+    language: str,
+    batch_size: int = 256,
+    cache_path: Optional[str] = None,
+    cache_max_entries: Optional[int] = None,
+) -> UdParses:
+    """
+    Parse every verse that UD tasks use. If `cache_path` is given, parses are looked up in and added to a
+    `UdParseCache` there, so that only verses with new or changed text are parsed.
+    """
+    verses = verses_to_parse(verses)
+    texts = list(dict.fromkeys(v.verse.body for v in verses))
+    if cache_path is None:
+        by_text = dict(zip(texts, parse_texts(texts, language, batch_size)))
+    else:
+        model = stanza_model_key()
+        with UdParseCache(cache_path, cache_max_entries) as cache:
+            by_text = cache.get_many(model, language, texts)
+            missing = [t for t in texts if t not in by_text]
+            logger.info(f"UD parse cache: {cache.hits} hits, {cache.misses} misses")
+            if len(missing) > 0:
+                new_parses = parse_texts(missing, language, batch_size)
+                cache.put_many(model, language, zip(missing, new_parses))
+                by_text.update(zip(missing, new_parses))
+            cache.evict()
+    return UdParses(language, {v.reference: by_text[v.verse.body] for v in verses})
+
+
+def _format_conllu_value(key, value):
+    if value is None:
+        return "_"
+    if key == "id" and isinstance(value, tuple):
+        return "-".join(str(x) for x in value)
+    return str(value)
+
+
+def _parse_conllu_value(key, value):
+    if key == "id":
+        return tuple(int(x) for x in value.split("-")) if "-" in value else int(value)
+    if key == "head":
+        return int(value)
+    return value
+
+
+@Format.register("pronto::ud_parses")
+class UdParsesFormat(Format[UdParses]):
+    """
+    Stores `UdParses` as a single CoNLL-U file. Each verse starts with a comment-only `# verse = ...` block, so
+    that verses whose parse has no sentences are kept, and each sentence carries a `# reference = ...` comment
+    naming the verse it belongs to.
+    """
+
+    VERSION = "002"
+
+    def write(self, artifact: UdParses, dir: PathOrStr):
+        with open(Path(dir) / "parses.conllu", "w") as f:
+            f.write(f"# language = {artifact.language}\n\n")
+            for reference, parse in artifact.parses.items():
+                f.write(f"# verse = {reference}\n\n")
+                for sentence in parse:
+                    f.write(f"# reference = {reference}\n")
+                    for word in sentence:
+                        f.write("\t".join(_format_conllu_value(k, word.get(k)) for k in CONLLU_FIELDS) + "\n")
+                    f.write("\n")
+
+    def read(self, dir: PathOrStr) -> UdParses:
+        language = None
+        parses = {}
+        with open(Path(dir) / "parses.conllu", "r") as f:
+            for block in f.read().split("\n\n"):
+                lines = [l for l in block.split("\n") if l != ""]
+                comments = dict(l[2:].split(" = ", 1) for l in lines if l.startswith("# "))
+                if "language" in comments:
+                    language = comments["language"]
+                if "verse" in comments:
+                    parses.setdefault(comments["verse"], [])
+                if "reference" not in comments:
+                    continue
+                sentence = []
+                for line in lines:
+                    if not line.startswith("#"):
+                        sentence.append(
+                            {
+                                k: _parse_conllu_value(k, v)
+                                for k, v in zip(CONLLU_FIELDS, line.split("\t"))
+                                if v != "_" or k == "text"
+                            }
+                        )
+                parses.setdefault(comments["reference"], []).append(sentence)
+        return UdParses(language, parses)
+
+
+class UdTaskSpec(StreamingTaskSpec):
+    """
+    A task which needs UD parses of the target-language verses. Parses are taken from a shared `ud_parses`
+    resource when one is given (see `pronto.steps::parse_ud`), and are otherwise made here.
+    """
+
+    RESOURCES = ("ud_parses",)
+
+    def __init__(
+        self,
+        language: str = "hi",
+        batch_size: int = 256,
+        cache_path: Optional[str] = None,
+        cache_max_entries: Optional[int] = None,
+        split_ratios: Tuple[float, float, float] = DEFAULT_SPLIT_RATIOS,
+        shuffle_split: bool = False,
+        writer: Optional[RowWriter] = None,
+    ):
+        super().__init__(split_ratios, shuffle_split, writer)
+        self.language = language
+        self.batch_size = batch_size
+        self.cache_path = cache_path
+        self.cache_max_entries = cache_max_entries
+
+    def rows(self, verses: List[AlignedVerse], ud_parses: Optional[UdParses] = None) -> Iterator[Tuple]:
+        if ud_parses is None:
+            ud_parses = parse_verses(verses, self.language, self.batch_size, self.cache_path, self.cache_max_entries)
+        elif ud_parses.language != self.language:
+            raise ValueError(f"{type(self).__name__} expects {self.language} parses, got {ud_parses.language}")
+        return self.parsed_rows(verses, ud_parses)
+
+    def parsed_rows(self, verses: List[AlignedVerse], ud_parses: UdParses) -> Iterator[Tuple]:
+        raise NotImplementedError()
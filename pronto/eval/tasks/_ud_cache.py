@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import sqlite3
+from logging import getLogger
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = getLogger(__name__)
+
+# A parse is what stanza's `Document.to_dict()` returns: a list of sentences, each a list of word dicts
+Parse = List[List[dict]]
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def stanza_model_key() -> str:
+    """
+    Identify the stanza release and model resources that parses were made with, without loading any models.
+    """
+    import stanza
+
+    return f"stanza={stanza.__version__};resources={getattr(stanza, '__resources_version__', stanza.__version__)}"
+
+
+def _encode_parse(parse: Parse) -> str:
+    return json.dumps(parse, ensure_ascii=False)
+
+
+def _decode_parse(s: str) -> Parse:
+    parse = json.loads(s)
+    for sentence in parse:
+        for word in sentence:
+            # JSON turns the (start, end) ids of multi-word tokens into lists
+            if isinstance(word.get("id"), list):
+                word["id"] = tuple(word["id"])
+    return parse
+
+
+class UdParseCache:
+    """
+    A persistent SQLite store of UD parses keyed by (model, language, hash of the parsed text), so that verses
+    whose text has not changed are never handed to stanza twice.
+
+    Each lookup refreshes an entry's access stamp. If `max_entries` is set, `evict()` drops the least
+    recently used entries beyond it. Hit and miss counts accumulate over the life of the object.
+    """
+
+    def __init__(self, path: str, max_entries: Optional[int] = None):
+        if os.path.dirname(path) != "":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS parses ("
+            "model TEXT NOT NULL, language TEXT NOT NULL, text_hash TEXT NOT NULL, "
+            "parse TEXT NOT NULL, last_access INTEGER NOT NULL, "
+            "PRIMARY KEY (model, language, text_hash))"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS parses_last_access ON parses (last_access)")
+        self._clock = self._connection.execute("SELECT COALESCE(MAX(last_access), 0) FROM parses").fetchone()[0]
+
+    def _tick(self) -> int:
+        self._clock += 1
+        return self._clock
+
+    def __len__(self):
+        return self._connection.execute("SELECT COUNT(*) FROM parses").fetchone()[0]
+
+    def get_many(self, model: str, language: str, texts: Iterable[str]) -> Dict[str, Parse]:
+        found = {}
+        with self._connection:
+            for text in texts:
+                key = (model, language, text_hash(text))
+                row = self._connection.execute(
+                    "SELECT parse FROM parses WHERE model = ? AND language = ? AND text_hash = ?", key
+                ).fetchone()
+                if row is None:
+                    self.misses += 1
+                    continue
+                self.hits += 1
+                found[text] = _decode_parse(row[0])
+                self._connection.execute(
+                    "UPDATE parses SET last_access = ? WHERE model = ? AND language = ? AND text_hash = ?",
+                    (self._tick(), *key),
+                )
+        return found
+
+    def put_many(self, model: str, language: str, items: Iterable[Tuple[str, Parse]]) -> None:
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO parses VALUES (?, ?, ?, ?, ?)",
+                ((model, language, text_hash(text), _encode_parse(parse), self._tick()) for text, parse in items),
+            )
+
+    def evict(self) -> int:
+        """
+        Drop least recently used entries until at most `max_entries` remain, returning how many were dropped.
+        """
+        if self.max_entries is None:
+            return 0
+        with self._connection:
+            cursor = self._connection.execute(
+                "DELETE FROM parses WHERE rowid IN "
+                "(SELECT rowid FROM parses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+        if cursor.rowcount > 0:
+            logger.info(f"Evicted {cursor.rowcount} entries from UD parse cache {self.path}")
+        return cursor.rowcount
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def __enter__(self) -> "UdParseCache":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
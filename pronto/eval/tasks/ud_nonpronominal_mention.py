@@ -1,20 +1,17 @@
-from pathlib import Path
-from typing import List
-
-from stanza import Pipeline
+from typing import Iterator, List, Tuple
 
 from pronto.aligning import AlignedVerse
-from pronto.tasks._util import train_dev_test_split
+from pronto.eval.tasks._ud import UdParses, UdTaskSpec, verses_to_parse
 from pronto.tasks.spec import TaskSpec
 
 
-def process_verse(verse, pipeline):
-    output = pipeline(verse.verse.body)
-
+def process_verse(verse, parse):
     mentions = 0
-    for token in output.iter_tokens():
-        for word in token.words:
-            word = word.to_dict()
+    for sentence in parse:
+        for word in sentence:
+            # skip multi-word tokens, whose ids are ranges; their words follow them
+            if not isinstance(word["id"], int):
+                continue
             if (
                 "upos" in word
                 and word["upos"] in ["PROPN", "NOUN"]
@@ -25,24 +22,17 @@ def process_verse(verse, pipeline):
     return verse.verse.body, mentions, verse.reference
 
 
-def process_verses(verses, output_dir, pipeline):
-    outputs = []
-    for verse in verses:
-        if not verse.is_cross_verse:
-            outputs.append(process_verse(verse, pipeline))
-    with open(Path(output_dir) / Path(f"ud_nonpronominal_mention.tsv"), "w") as f:
-        for s, c, r in outputs:
-            f.write(f"{s}\t{c}\t{r}\n")
-    for split, rows in zip(["train", "dev", "test"], train_dev_test_split(outputs)):
-        with open(Path(output_dir) / Path(f"ud_nonpronominal_mention_{split}.tsv"), "w") as f:
-            for s, c, r in rows:
-                f.write(f"{s}\t{c}\t{r}\n")
+def generate_rows(verses, ud_parses) -> Iterator[Tuple[str, int, str]]:
+    for verse in verses_to_parse(verses):
+        yield process_verse(verse, ud_parses[verse])
 
 
 @TaskSpec.register("ud_nonpronominal_mention")
-class UdNonpronominalMention(TaskSpec):
-    VERSION = "C"
-
-    def process(self, verses: List[AlignedVerse], output_dir: str) -> None:
-        pipeline = Pipeline(lang="hi")
-        process_verses(verses, output_dir, pipeline)
+class UdNonpronominalMention(UdTaskSpec):
+    VERSION = "D"
+    NAME = "ud_nonpronominal_mention"
+    COLUMNS = ("text", "nonpronominal_mentions", "reference")
+    WRITE_ALL = True
+
+    def parsed_rows(self, verses: List[AlignedVerse], ud_parses: UdParses) -> Iterator[Tuple[str, int, str]]:
+        return generate_rows(verses, ud_parses)
@@ -1,27 +1,16 @@
 from collections import defaultdict
 from logging import getLogger
-from pathlib import Path
-from typing import List
-
-from stanza import Pipeline
+from typing import Iterator, List, Tuple
 
 from pronto.aligning import AlignedVerse
-from pronto.tasks._util import token_yield_of_tree_node, train_dev_test_split
+from pronto.eval.tasks._ud import UdParses, UdTaskSpec, verses_to_parse
+from pronto.tasks._util import is_contiguous, token_yield_of_tree_node
 from pronto.tasks.spec import TaskSpec
 
 logger = getLogger(__name__)
 
 
-def is_contiguous(indexes):
-    if len(indexes) == 0:
-        return True
-    for i in range(1, len(indexes)):
-        if indexes[i - 1] != indexes[i] - 1:
-            return False
-    return True
-
-
-def process_verse(verse, pipeline):
+def process_verse(verse, parse):
     first_sentence = verse.ontonotes_sentences[0]
     parsed_tree = first_sentence.tree.parsed_tree
     subject_tokens = token_yield_of_tree_node(parsed_tree, "NP-SBJ")
@@ -34,8 +23,10 @@ def process_verse(verse, pipeline):
         )
         return None
 
-    output = pipeline(verse.verse.body)
-    sentence = output.sentences[0].to_dict()
+    if len(parse) == 0:
+        logger.debug(f"Skipping verse because its parse has no sentences: {verse.reference}")
+        return None
+    sentence = parse[0]
     word_index = {w["id"]: w for w in sentence if isinstance(w["id"], int)}
     head_map = {w["id"]: w["head"] for w in sentence if isinstance(w["id"], int)}
 
@@ -58,24 +49,19 @@ def process_verse(verse, pipeline):
     return verse.verse.body, 0, verse.reference
 
 
-def process_verses(verses, output_dir, pipeline):
-    outputs = []
-    for verse in verses:
-        if not verse.is_cross_verse:
-            output = process_verse(verse, pipeline)
-            if output is not None:
-                outputs.append(output)
-    with open(Path(output_dir) / Path(f"ud_proper_noun_subject.tsv"), "w") as f:
-        for s, c, r in outputs:
-            f.write(f"{s}\t{c}\t{r}\n")
-    for split, rows in zip(["train", "dev", "test"], train_dev_test_split(outputs)):
-        with open(Path(output_dir) / Path(f"ud_proper_noun_subject_{split}.tsv"), "w") as f:
-            for s, c, r in rows:
-                f.write(f"{s}\t{c}\t{r}\n")
+def generate_rows(verses, ud_parses) -> Iterator[Tuple[str, int, str]]:
+    for verse in verses_to_parse(verses):
+        output = process_verse(verse, ud_parses[verse])
+        if output is not None:
+            yield output
 
 
 @TaskSpec.register("ud_proper_noun_subject")
-class UdProperNounSubject(TaskSpec):
-    def process(self, verses: List[AlignedVerse], output_dir: str) -> None:
-        pipeline = Pipeline(lang="hi")
-        process_verses(verses, output_dir, pipeline)
+class UdProperNounSubject(UdTaskSpec):
+    VERSION = "A"
+    NAME = "ud_proper_noun_subject"
+    COLUMNS = ("text", "proper_noun_subject", "reference")
+    WRITE_ALL = True
+
+    def parsed_rows(self, verses: List[AlignedVerse], ud_parses: UdParses) -> Iterator[Tuple[str, int, str]]:
+        return generate_rows(verses, ud_parses)
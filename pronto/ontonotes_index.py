@@ -0,0 +1,215 @@
+import hashlib
+import json
+import mmap
+import pickle
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from onf_parser import Section
+from onf_parser.models import Sentence, SpeakerInformation
+from tango import Format
+from tango.common import PathOrStr
+
+from pronto.consts import ONTONOTES_BLACKLIST
+
+
+def parse_ontonotes_time(s: str):
+    pieces = s.split(":")
+    pieces = [p.split("_") for p in pieces]
+    assert all(len(p) == 3 for p in pieces)
+    return pieces
+
+
+def parse_ontonotes_speaker_info(info: SpeakerInformation):
+    book = info.name
+    start = parse_ontonotes_time(info.start_time)
+    stop = parse_ontonotes_time(info.stop_time)
+    return book, start, stop
+
+
+def verse_key(chapter: int, verse: int) -> int:
+    """
+    Pack a chapter and verse number into one integer, which orders like the (chapter, verse) pair.
+    """
+    return chapter << 32 | verse
+
+
+def split_verse_key(key: int) -> Tuple[int, int]:
+    return key >> 32, key & 0xFFFFFFFF
+
+
+class OntonotesVerseIndex:
+    """
+    A verse-keyed index of the OntoNotes sentences that carry Bible speaker information.
+
+    The index itself is a flat table with one record per (book, chapter, verse, sentence) pairing, in the
+    order in which the pairings occur in OntoNotes. Sentences are stored once each and are only materialized
+    when `sentences()` asks for them, so when the index is read from disk (see `OntonotesVerseIndexFormat`)
+    only the small record table is loaded up front and sentences are unpickled lazily from a memory map.
+
+    Indexing with `index[book][chapter][verse]` gives the ids of that verse's sentences, with chapters and
+    verses in the order they were first seen. `verses(book)` gives the same mapping flattened, keyed by
+    `verse_key(chapter, verse)`.
+    """
+
+    def __init__(
+        self,
+        book_names: List[str],
+        records: Tuple[array, array, array, array],
+        sentences: List[Optional[Sentence]],
+        blob=None,
+        offsets: Optional[array] = None,
+    ):
+        self.book_names = book_names
+        self.records = records
+        self._sentences = sentences
+        self._blob = blob
+        self._offsets = offsets
+        self._nested = None
+        self._flat = None
+
+    @classmethod
+    def from_ontonotes(cls, ontonotes_data: List[Tuple[str, List[Section]]]) -> "OntonotesVerseIndex":
+        book_names = []
+        book_ids = {}
+        records = (array("H"), array("H"), array("H"), array("I"))
+        seen = set()
+        sentences = []
+        for filename, sections in ontonotes_data:
+            for section in sections:
+                for sentence in section.sentences:
+                    if sentence.speaker_information is None:
+                        continue
+                    book, start, stop = parse_ontonotes_speaker_info(sentence.speaker_information)
+                    book = book.replace("_", " ")
+                    if book not in book_ids:
+                        book_ids[book] = len(book_names)
+                        book_names.append(book)
+                    sentence_id = None
+                    for chapter, verse, _ in start + stop:
+                        chapter = int(chapter)
+                        verse = int(verse)
+                        if (book, chapter, verse) in ONTONOTES_BLACKLIST:
+                            continue
+                        if sentence_id is None:
+                            sentence_id = len(sentences)
+                            sentences.append(sentence)
+                        # a sentence which starts and stops in the same verse should only be listed once
+                        if (sentence_id, chapter, verse) in seen:
+                            continue
+                        seen.add((sentence_id, chapter, verse))
+                        for column, value in zip(records, (book_ids[book], chapter, verse, sentence_id)):
+                            column.append(value)
+        return cls(book_names, records, sentences)
+
+    def __len__(self):
+        return len(self.records[0])
+
+    def _index(self) -> Dict[str, Dict[int, Dict[int, List[int]]]]:
+        if self._nested is None:
+            nested = {}
+            for book_id, chapter, verse, sentence_id in zip(*self.records):
+                chapters = nested.setdefault(self.book_names[book_id], {})
+                chapters.setdefault(chapter, {}).setdefault(verse, []).append(sentence_id)
+            self._nested = nested
+        return self._nested
+
+    def __getitem__(self, book: str) -> Dict[int, Dict[int, List[int]]]:
+        return self._index()[book]
+
+    def keys(self):
+        return self._index().keys()
+
+    def verses(self, book: str) -> Dict[int, List[int]]:
+        if self._flat is None:
+            self._flat = {
+                book: {
+                    verse_key(chapter, verse): ids
+                    for chapter, verses in chapters.items()
+                    for verse, ids in verses.items()
+                }
+                for book, chapters in self._index().items()
+            }
+        return self._flat[book]
+
+    def digest(self) -> str:
+        """
+        A hash of the index's records, which identifies how verses map to sentence ids.
+        """
+        h = hashlib.sha256(json.dumps(self.book_names).encode("utf-8"))
+        for column in self.records:
+            h.update(column.typecode.encode("ascii"))
+            h.update(column.tobytes())
+        return h.hexdigest()
+
+    def sentences(self, sentence_ids: Iterable[int]) -> List[Sentence]:
+        result = []
+        for i in sentence_ids:
+            sentence = self._sentences[i]
+            if sentence is None:
+                sentence = pickle.loads(self._blob[self._offsets[i] : self._offsets[i + 1]])
+                self._sentences[i] = sentence
+            result.append(sentence)
+        return result
+
+    def load_all(self) -> "OntonotesVerseIndex":
+        """
+        Materialize every sentence, e.g. before forking workers which should share them.
+        """
+        self.sentences(range(len(self._sentences)))
+        return self
+
+    def __getstate__(self):
+        self.load_all()
+        state = self.__dict__.copy()
+        state["_blob"] = None
+        state["_offsets"] = None
+        state["_nested"] = None
+        state["_flat"] = None
+        return state
+
+
+@Format.register("pronto::ontonotes_verse_index")
+class OntonotesVerseIndexFormat(Format[OntonotesVerseIndex]):
+    """
+    Stores an `OntonotesVerseIndex` as a handful of flat files: `index.json` for the book names, one binary
+    array per record column, and `sentences.bin`, a concatenation of individually pickled sentences whose
+    boundaries are given by `offsets.bin`.
+    """
+
+    VERSION = "001"
+    COLUMNS = ["book", "chapter", "verse", "sentence"]
+
+    def write(self, artifact: OntonotesVerseIndex, dir: PathOrStr):
+        dir = Path(dir)
+        with open(dir / "index.json", "w") as f:
+            json.dump({"books": artifact.book_names, "sentence_count": len(artifact._sentences)}, f)
+        for name, column in zip(self.COLUMNS, artifact.records):
+            with open(dir / f"{name}.bin", "wb") as f:
+                f.write(column.typecode.encode("ascii"))
+                column.tofile(f)
+        offsets = array("Q", [0])
+        with open(dir / "sentences.bin", "wb") as f:
+            for sentence in artifact.sentences(range(len(artifact._sentences))):
+                offsets.append(offsets[-1] + f.write(pickle.dumps(sentence, protocol=pickle.HIGHEST_PROTOCOL)))
+        with open(dir / "offsets.bin", "wb") as f:
+            offsets.tofile(f)
+
+    def read(self, dir: PathOrStr) -> OntonotesVerseIndex:
+        dir = Path(dir)
+        with open(dir / "index.json", "r") as f:
+            header = json.load(f)
+        records = []
+        for name in self.COLUMNS:
+            with open(dir / f"{name}.bin", "rb") as f:
+                column = array(f.read(1).decode("ascii"))
+                column.frombytes(f.read())
+                records.append(column)
+        offsets = array("Q")
+        with open(dir / "offsets.bin", "rb") as f:
+            offsets.frombytes(f.read())
+        with open(dir / "sentences.bin", "rb") as f:
+            blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if offsets[-1] > 0 else b""
+        sentences = [None] * header["sentence_count"]
+        return OntonotesVerseIndex(header["books"], tuple(records), sentences, blob, offsets)
@@ -1,61 +1,101 @@
-from collections import defaultdict
+import hashlib
 from dataclasses import dataclass
 from logging import getLogger
-from typing import List
+from typing import Dict, List
 
 from pronto.consts import BOOKS_L2S, BOOKS_S2L
 
 logger = getLogger(__name__)
 
 
+# These classes declare __slots__, since a Bible has tens of thousands of verses and a multi-language run may
+# hold many Bibles at once. Their indexes are built on first use and kept, so contents should not be changed
+# after a lookup.
+
+
 @dataclass
 class Verse:
+    __slots__ = ("id", "body")
     id: int
     body: str
 
 
 @dataclass
 class Chapter:
+    __slots__ = ("id", "verses", "_indexed_verses")
     id: int
     verses: List[Verse]
 
     @property
-    def indexed_verses(self):
-        return {v.id: v for v in self.verses}
+    def indexed_verses(self) -> Dict[int, Verse]:
+        try:
+            return self._indexed_verses
+        except AttributeError:
+            self._indexed_verses = {v.id: v for v in self.verses}
+            return self._indexed_verses
 
 
 @dataclass
 class Book:
+    __slots__ = ("id", "chapters", "_indexed_chapters", "_digest")
     id: str
     chapters: List[Chapter]
 
     @property
-    def indexed_chapters(self):
-        return {c.id: c for c in self.chapters}
+    def indexed_chapters(self) -> Dict[int, Chapter]:
+        try:
+            return self._indexed_chapters
+        except AttributeError:
+            self._indexed_chapters = {c.id: c for c in self.chapters}
+            return self._indexed_chapters
+
+    @property
+    def digest(self) -> str:
+        """
+        A hash of the book's content, so that unchanged books can be recognized (see `book_digest`)
+        """
+        try:
+            return self._digest
+        except AttributeError:
+            self._digest = book_digest(self.chapters)
+            return self._digest
+
+
+def book_digest(chapters: List[Chapter]) -> str:
+    h = hashlib.sha256()
+    for chapter in chapters:
+        for verse in chapter.verses:
+            h.update(f"{chapter.id}\t{verse.id}\t{verse.body}\n".encode("utf-8"))
+    return h.hexdigest()
 
 
 def read_bible_tsv(path: str) -> List[Book]:
     logger.info(f"Reading from {path}")
-    books = defaultdict(lambda: defaultdict(lambda: dict()))
-    book = []
+    # book -> chapter -> verse -> body, as plain dicts: these are hit once per line, so `dict.get` is used
+    # rather than defaultdicts with lambda factories. A later line for the same verse replaces an earlier one.
+    books = {}
     with open(path, "r") as f:
         for line in f:
             try:
                 pieces = line.split("\t")
                 book_id = pieces[0]
                 chapter_id = int(pieces[1])
-                if book_id not in book:
-                    book.append(book_id)
                 try:
                     verse_id = int(pieces[2])
                 except ValueError:
                     logger.warning(f"{book_id} {chapter_id}: found non-integer verse {pieces[2]}. Skipping.")
                     continue
-                body = pieces[3]
-                if body.strip() == "":
+                body = pieces[3].strip()
+                if body == "":
                     logger.warning(f"{book_id} {chapter_id}: verse {pieces[2]} is empty. Skipping.")
                     continue
-                books[book_id][chapter_id][verse_id] = body.strip()
+                chapters = books.get(book_id)
+                if chapters is None:
+                    chapters = books[book_id] = {}
+                verses = chapters.get(chapter_id)
+                if verses is None:
+                    verses = chapters[chapter_id] = {}
+                verses[verse_id] = body
             except Exception as e:
                 logger.error(f"Error encountered while handling a line: {line} ({pieces})")
                 logger.exception(e)
@@ -64,14 +104,14 @@ def read_bible_tsv(path: str) -> List[Book]:
         if book_id not in BOOKS_S2L:
             logger.warning(f"Unknown bookcode: {book_id}")
 
-    book_objs = []
-    for book_id in BOOKS_S2L.keys():
-        if book_id in books:
-            chapter_objs = []
-            for chapter_id, verses in sorted(books[book_id].items(), key=lambda x: x[0]):
-                verse_objs = []
-                for verse_id, verse in sorted(verses.items(), key=lambda x: x[0]):
-                    verse_objs.append(Verse(verse_id, verse))
-                chapter_objs.append(Chapter(chapter_id, verse_objs))
-            book_objs.append(Book(book_id, chapter_objs))
-    return book_objs
+    return [
+        Book(
+            book_id,
+            [
+                Chapter(chapter_id, [Verse(verse_id, body) for verse_id, body in sorted(verses.items())])
+                for chapter_id, verses in sorted(books[book_id].items())
+            ],
+        )
+        for book_id in BOOKS_S2L.keys()
+        if book_id in books
+    ]
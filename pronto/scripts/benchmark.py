@@ -0,0 +1,446 @@
+"""
+Benchmarks for the slower stages of dataset construction. Each subcommand prints a small table of timings;
+run e.g. `python -m pronto.scripts.benchmark usfx --help` for options. Checks that the alternatives being timed
+give the same results live in `tests/`.
+"""
+
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import get_context
+from tempfile import TemporaryDirectory
+
+import click
+
+
+def _in_fresh_process(f, *args):
+    """
+    Run `f(*args)` in a newly spawned interpreter and return (result, seconds, peak RSS in MB) so that memory
+    measurements are not polluted by earlier runs.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        return executor.submit(_timed, f, *args).result()
+
+
+def _timed(f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    elapsed = time.perf_counter() - start
+    return result, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _retained_mb(f, *args):
+    """
+    Call `f(*args)` and return its result along with how many MB of memory the result holds on to.
+    """
+    import tracemalloc
+
+    tracemalloc.start()
+    try:
+        result = f(*args)
+        return result, tracemalloc.get_traced_memory()[0] / 2**20
+    finally:
+        tracemalloc.stop()
+
+
+def _print_table(header, rows):
+    widths = [max(len(str(x)) for x in column) for column in zip(header, *rows)]
+    for row in [header] + rows:
+        print("  ".join(str(x).ljust(w) for x, w in zip(row, widths)))
+
+
+def _load_aligned_verses(ontonotes_path, bible_path):
+    """
+    Align a Bible TSV against OntoNotes, given either an OntoNotes directory or a Dill file holding the output
+    of `pronto.steps::read_ontonotes`.
+    """
+    import logging
+
+    from onf_parser import parse_files
+
+    from pronto.aligning import align_verses_to_index, index_ontonotes
+    from pronto.common import dill_load
+    from pronto.reading import read_bible_tsv
+
+    logging.getLogger("pronto").setLevel(logging.ERROR)
+    ontonotes_data = parse_files(ontonotes_path) if os.path.isdir(ontonotes_path) else dill_load(ontonotes_path)
+    return align_verses_to_index(index_ontonotes(ontonotes_data), read_bible_tsv(bible_path), threshold=0)
+
+
+def _write_synthetic_usfx(path, books, chapters, verses):
+    with open(path, "w") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<usfx>\n')
+        for b in range(books):
+            f.write(f'<book id="B{b:02d}"><h>Book {b}</h>\n')
+            for c in range(1, chapters + 1):
+                f.write(f'<c id="{c}" /><cl>Chapter {c}</cl>\n<p>')
+                for v in range(1, verses + 1):
+                    f.write(
+                        f'<v id="{v}" />In the <w s="G{v}">beginning</w> was the word'
+                        f'<f caller="+"><fr>{c}:{v} </fr><ft>Or, "the account"</ft></f>, '
+                        f'and <ref tgt="B{b:02d}.{c}.{v}">the word</ref> was with God.<ve />\n'
+                    )
+                f.write("</p>\n")
+            f.write("</book>\n")
+        f.write("</usfx>\n")
+
+
+def _write_synthetic_bible_tsv(path, chapters, verses, books=27):
+    from pronto.consts import BOOKS_S2L
+
+    with open(path, "w") as f:
+        # the last `books` books, i.e. by default the New Testament
+        for book in list(BOOKS_S2L.keys())[-books:]:
+            for c in range(1, chapters + 1):
+                for v in range(1, verses + 1):
+                    f.write(f"{book}\t{c}\t{v}\tAnd {book} said unto them, this is verse {v} of chapter {c}.\n")
+                f.write(f"{book}\t{c}\t{verses}a\tA verse with a non-integer id.\n")
+                f.write(f"{book}\t{c}\t{verses + 1}\t \n")
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.argument("usfx_paths", nargs=-1)
+@click.option("--books", default=27, type=int, help="Books in the synthetic input, used if no paths are given")
+@click.option("--chapters", default=30, type=int, help="Chapters per book in the synthetic input")
+@click.option("--verses", default=40, type=int, help="Verses per chapter in the synthetic input")
+def usfx(usfx_paths, books, chapters, verses):
+    """
+    Compare the streaming and BeautifulSoup USFX converters on time and peak memory.
+    """
+    from pronto.scripts.usfx_to_tsv import convert_dom, convert_streaming
+
+    with TemporaryDirectory() as tmp:
+        if len(usfx_paths) == 0:
+            synthetic_path = os.path.join(tmp, "synthetic_usfx.xml")
+            _write_synthetic_usfx(synthetic_path, books, chapters, verses)
+            usfx_paths = [synthetic_path]
+
+        rows = []
+        for path in usfx_paths:
+            size = os.path.getsize(path) / 2**20
+            for mode, convert in [("dom", convert_dom), ("streaming", convert_streaming)]:
+                _, elapsed, rss = _in_fresh_process(convert, path, os.path.join(tmp, f"{mode}.tsv"))
+                rows.append((os.path.basename(path), f"{size:.1f}", mode, f"{elapsed:.2f}", f"{rss:.0f}"))
+        _print_table(("input", "MB", "mode", "seconds", "peak RSS MB"), rows)
+
+
+@cli.command()
+@click.argument("ontonotes_path")
+@click.argument("bible_path")
+@click.option("--positive-pairs-per-instance", default=1, type=int)
+@click.option("--negative-per-positive", default=1, type=int)
+def sense_sampling(ontonotes_path, bible_path, positive_pairs_per_instance, negative_per_positive):
+    """
+    Time same_sense and same_arg_count task generation, and compare the cost of building their negative
+    sampling pools as complement views against building them as filtered lists, as was done before.
+    """
+    from pronto.tasks import same_arg_count, same_sense
+    from pronto.tasks._util import ExcludingSequence, concatenate_with_positions
+    from pronto.tasks.propositions import build_proposition_index
+
+    verses = _load_aligned_verses(ontonotes_path, bible_path)
+    specs = [
+        same_sense.SameSense(
+            positive_pairs_per_instance=positive_pairs_per_instance, negative_per_positive=negative_per_positive
+        ),
+        same_arg_count.SameArgCount(
+            positive_pairs_per_instance=positive_pairs_per_instance, negative_per_positive=negative_per_positive
+        ),
+    ]
+
+    proposition_index, seconds, _ = _timed(build_proposition_index, verses)
+    rows = [("-", "proposition index", f"{seconds:.3f}")]
+    with TemporaryDirectory() as tmp:
+        for spec in specs:
+            _, seconds, _ = _timed(partial(spec.process, verses, tmp, proposition_index=proposition_index))
+            rows.append((type(spec).__name__, "process (shared proposition index)", f"{seconds:.3f}"))
+
+    index = same_sense.build_index(specs[0], verses, proposition_index)
+
+    def filtered_lists():
+        return [[v for x in index if x != label for v in index[x] if v not in index[label]] for label in index]
+
+    def complement_views():
+        flat, positions = concatenate_with_positions(index.values())
+        return [ExcludingSequence(flat, [p for v in ids for p in positions[v]]) for ids in index.values()]
+
+    for name, f in [("filtered lists", filtered_lists), ("complement views", complement_views)]:
+        rows.append(("SameSense", f"negative pools ({name})", f"{_timed(f)[1]:.3f}"))
+    _print_table(("task", "stage", "seconds"), rows)
+    print(f"{len(verses)} aligned verses, {len(index)} sense labels")
+
+
+@cli.command()
+@click.argument("ontonotes_path")
+@click.option("--target", "targets", multiple=True, default=["NP-SBJ", "NP", "VP", "S", "PP"], help="May be repeated")
+@click.option("--repeat", default=3, type=int, help="Runs per measurement; the fastest is reported")
+def tree_yield(ontonotes_path, targets, repeat):
+    """
+    Time finding the yields of several targets in every tree in ONTONOTES_PATH (an OntoNotes directory, e.g.
+    the pt/nt annotations, or a read_ontonotes Dill file) one target at a time, against all in one pass.
+    """
+    from onf_parser import parse_files
+
+    from pronto.common import dill_load
+    from pronto.tasks._util import token_yield_of_tree_node, token_yields_of_tree_node
+
+    ontonotes_data = parse_files(ontonotes_path) if os.path.isdir(ontonotes_path) else dill_load(ontonotes_path)
+    # Tree.parsed_tree reparses on every access, so parse each tree once up front
+    trees = [
+        sentence.tree.parsed_tree
+        for _, sections in ontonotes_data
+        for section in sections
+        for sentence in section.sentences
+        if sentence.tree is not None
+    ]
+
+    def best_of(f):
+        return min(_timed(f)[1] for _ in range(repeat))
+
+    rows = [
+        (f"{targets[0]} only", f"{best_of(lambda: [token_yield_of_tree_node(t, targets[0]) for t in trees]):.3f}"),
+        (
+            f"{len(targets)} targets, one at a time",
+            f"{best_of(lambda: [token_yield_of_tree_node(t, x) for t in trees for x in targets]):.3f}",
+        ),
+        (
+            f"{len(targets)} targets, one pass",
+            f"{best_of(lambda: [token_yields_of_tree_node(t, targets) for t in trees]):.3f}",
+        ),
+    ]
+    _print_table(("query", "seconds"), rows)
+    print(f"{len(trees)} trees")
+
+
+@cli.command()
+@click.argument("tsv_paths", nargs=-1)
+@click.option(
+    "--chapters", default=30, type=int, help="Chapters per book in the synthetic input, if no paths are given"
+)
+@click.option("--verses", default=40, type=int, help="Verses per chapter in the synthetic input")
+def read_bible(tsv_paths, chapters, verses):
+    """
+    Time reading Bible TSVs. Paths may be TSV files or directories of `*-bible.tsv` files, so that e.g. every
+    converted Bible in data/tsv can be read in one run.
+    """
+    import glob
+    import logging
+
+    from pronto.reading import read_bible_tsv
+
+    logging.getLogger("pronto").setLevel(logging.ERROR)
+    with TemporaryDirectory() as tmp:
+        if len(tsv_paths) == 0:
+            synthetic_path = os.path.join(tmp, "synthetic-bible.tsv")
+            _write_synthetic_bible_tsv(synthetic_path, chapters, verses)
+            tsv_paths = [synthetic_path]
+        paths = []
+        for path in tsv_paths:
+            paths.extend(sorted(glob.glob(os.path.join(path, "*-bible.tsv"))) if os.path.isdir(path) else [path])
+
+        seconds = 0.0
+        n_verses = 0
+        megabytes = 0.0
+        for path in paths:
+            bible, elapsed, _ = _timed(read_bible_tsv, path)
+            seconds += elapsed
+            n_verses += sum(len(c.verses) for b in bible for c in b.chapters)
+            megabytes += os.path.getsize(path) / 2**20
+    _print_table(
+        ("files", "MB", "verses", "seconds", "verses/s"),
+        [(len(paths), f"{megabytes:.1f}", n_verses, f"{seconds:.2f}", f"{n_verses / seconds:.0f}")],
+    )
+
+
+@cli.command()
+@click.argument("tsv_paths", nargs=-1)
+@click.option(
+    "--chapters", default=30, type=int, help="Chapters per book in the synthetic input, if no paths are given"
+)
+@click.option("--verses", default=40, type=int, help="Verses per chapter in the synthetic input")
+@click.option("--lookups", default=100000, type=int, help="Random verse lookups per Bible")
+def bible_memory(tsv_paths, chapters, verses, lookups):
+    """
+    Measure the memory held by each Bible's `Book` objects and by its aligned verses, and the latency of
+    looking up verses by chapter and verse number.
+    """
+    import glob
+    import logging
+    import random
+
+    from pronto.aligning import AlignedVerse
+    from pronto.reading import read_bible_tsv
+
+    def align(books):
+        return [AlignedVerse(b.id, c.id, v.id, v, []) for b in books for c in b.chapters for v in c.verses]
+
+    def look_up(books, queries):
+        start = time.perf_counter()
+        for b, c, v in queries:
+            books[b].indexed_chapters[c].indexed_verses[v]
+        return (time.perf_counter() - start) / len(queries) * 1e6
+
+    logging.getLogger("pronto").setLevel(logging.ERROR)
+    random.seed(0)
+    with TemporaryDirectory() as tmp:
+        if len(tsv_paths) == 0:
+            synthetic_path = os.path.join(tmp, "synthetic-bible.tsv")
+            _write_synthetic_bible_tsv(synthetic_path, chapters, verses)
+            tsv_paths = [synthetic_path]
+        paths = []
+        for path in tsv_paths:
+            paths.extend(sorted(glob.glob(os.path.join(path, "*-bible.tsv"))) if os.path.isdir(path) else [path])
+
+        rows = []
+        n_verses = 0
+        for path in paths:
+            books, books_mb = _retained_mb(read_bible_tsv, path)
+            _, aligned_mb = _retained_mb(align, books)
+            verses = [(b, c, v) for b in books for c in b.chapters for v in c.verses]
+            n_verses += len(verses)
+            queries = [(b.id, c.id, v.id) for b, c, v in random.choices(verses, k=lookups)]
+            latency = look_up({b.id: b for b in books}, queries)
+            rows.append((os.path.basename(path), f"{books_mb:.1f}", f"{aligned_mb:.1f}", f"{latency:.2f}"))
+        _print_table(("input", "books MB", "aligned verses MB", "lookup us"), rows)
+        print(f"{len(paths)} files, {n_verses} verses.")
+
+
+@cli.command()
+@click.argument("ontonotes_path")
+@click.argument("bible_paths", nargs=-1)
+@click.option("--bibles", default=20, type=int, help="Synthetic Bibles to align, if no paths are given")
+@click.option(
+    "--chapters", default=30, type=int, help="Chapters per book in the synthetic Bibles, which have every book"
+)
+@click.option("--verses", default=40, type=int, help="Verses per chapter in the synthetic Bibles")
+def align(ontonotes_path, bible_paths, bibles, chapters, verses):
+    """
+    Time aligning many Bibles against one OntoNotes index. Paths may be TSV files or directories of
+    `*-bible.tsv` files.
+    """
+    import gc
+    import glob
+    import logging
+
+    from onf_parser import parse_files
+
+    from pronto.aligning import align_verses_to_index_with_stats, index_ontonotes
+    from pronto.common import dill_load
+    from pronto.consts import BOOKS_S2L
+    from pronto.reading import read_bible_tsv
+
+    logging.getLogger("pronto").setLevel(logging.ERROR)
+    ontonotes_data = parse_files(ontonotes_path) if os.path.isdir(ontonotes_path) else dill_load(ontonotes_path)
+    index = index_ontonotes(ontonotes_data)
+    for book in index.keys():
+        index.verses(book)
+
+    with TemporaryDirectory() as tmp:
+        paths = []
+        for path in bible_paths:
+            paths.extend(sorted(glob.glob(os.path.join(path, "*-bible.tsv"))) if os.path.isdir(path) else [path])
+        if len(paths) == 0:
+            synthetic_path = os.path.join(tmp, "synthetic-bible.tsv")
+            _write_synthetic_bible_tsv(synthetic_path, chapters, verses, books=len(BOOKS_S2L))
+            paths = [synthetic_path] * bibles
+        bible_data = [read_bible_tsv(path) for path in paths]
+
+    seconds = 0.0
+    aligned = 0
+    mismatched_books = 0
+    # with many Bibles in memory, garbage collection passes would otherwise dominate the timings
+    gc.collect()
+    gc.disable()
+    for books in bible_data:
+        (_, stats), elapsed, _ = _timed(align_verses_to_index_with_stats, index, books, 0)
+        seconds += elapsed
+        aligned += stats.aligned
+        mismatched_books += sum(1 for s in stats.books.values() if s.is_mismatched)
+    gc.enable()
+    _print_table(
+        ("Bibles", "seconds", "s per Bible"), [(len(bible_data), f"{seconds:.3f}", f"{seconds / len(bible_data):.4f}")]
+    )
+    print(f"{aligned} aligned verses, {mismatched_books} mismatched books")
+
+
+@cli.command()
+@click.argument("ontonotes_path")
+@click.argument("bible_path")
+@click.option("--repeat", default=3, type=int, help="Runs per measurement; the fastest is reported")
+def verse_features(ontonotes_path, bible_path, repeat):
+    """
+    Time the task specs which filter the per-verse feature table when each builds its own table, against
+    building the table once and sharing it.
+    """
+    from pronto.tasks.features import build_verse_features
+    from pronto.tasks.nonpronominal_mention import NonpronominalMention
+    from pronto.tasks.proper_noun_subject import ProperNounSubject
+    from pronto.tasks.sentence_mood import SentenceMood
+
+    verses = _load_aligned_verses(ontonotes_path, bible_path)
+    specs = [NonpronominalMention(), ProperNounSubject(), SentenceMood()]
+
+    def separate(output_dir):
+        for spec in specs:
+            spec.process(verses, output_dir)
+
+    def shared(output_dir):
+        features = build_verse_features(verses)
+        for spec in specs:
+            spec.process(verses, output_dir, verse_features=features)
+
+    rows = []
+    with TemporaryDirectory() as tmp:
+        for name, f in [("per spec", separate), ("shared", shared)]:
+            os.makedirs(os.path.join(tmp, name))
+            seconds = min(_timed(f, os.path.join(tmp, name))[1] for _ in range(repeat))
+            rows.append((name, f"{seconds:.3f}"))
+    _print_table(("feature table", "seconds"), rows)
+    print(f"{len(verses)} aligned verses, feature table {build_verse_features(verses).table.nbytes / 2**20:.1f} MB")
+
+
+@cli.command()
+@click.argument("ontonotes_path")
+@click.argument("bible_path")
+@click.option("--pairs-per-instance", "pairs_per_instance", multiple=True, default=[1, 4, 16], type=int)
+def pair_streaming(ontonotes_path, bible_path, pairs_per_instance):
+    """
+    Compare the time and peak traced memory of writing same_sense pairs as they are drawn against collecting
+    and shuffling them first, as `shuffle_split` does.
+    """
+    import tracemalloc
+
+    from pronto.tasks.propositions import build_proposition_index
+    from pronto.tasks.same_sense import SameSense
+
+    verses = _load_aligned_verses(ontonotes_path, bible_path)
+    proposition_index = build_proposition_index(verses)
+
+    rows = []
+    with TemporaryDirectory() as tmp:
+        for n in pairs_per_instance:
+            for shuffle_split in [True, False]:
+                spec = SameSense(positive_pairs_per_instance=n, shuffle_split=shuffle_split)
+                tracemalloc.start()
+                try:
+                    _, seconds, _ = _timed(partial(spec.process, verses, tmp, proposition_index=proposition_index))
+                    peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+                finally:
+                    tracemalloc.stop()
+                pairs = 0
+                for name in os.listdir(tmp):
+                    with open(os.path.join(tmp, name)) as f:
+                        pairs += sum(1 for _ in f)
+                rows.append((n, "shuffled" if shuffle_split else "streamed", pairs, f"{seconds:.3f}", f"{peak_mb:.1f}"))
+    _print_table(("pairs per instance", "split", "pairs", "seconds", "peak MB"), rows)
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,50 +1,280 @@
 import csv
-import sys
+import hashlib
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Tuple
 
 import bs4
+import click
 from bs4 import BeautifulSoup
+from lxml import etree
+
+# see https://ebible.org/usfx/usfx.htm
+SKIPPED_TAGS = (
+    "h",  # header
+    "f",  # footnote
+    "cl",  # chapter label
+    "generated",  # generated content
+    "ref",  # reference
+)
+CHUNK_SIZE = 1 << 16
+MANIFEST_NAME = ".usfx_to_tsv.json"
+SUMMARY_NAME = "usfx_to_tsv_summary.tsv"
+
+
+class VerseRowWriter:
+    """
+    Turns a document-order sequence of USFX elements and text nodes into TSV rows. Both converters below
+    drive this same state machine, which is what keeps their outputs identical.
+    """
+
+    def __init__(self, f):
+        self.writer = csv.writer(f, delimiter="\t", lineterminator="\n")
+        self.book = None
+        self.chapter = None
+        self.verse = None
+        self.verse_buffer = []
+
+    def element(self, name, attrs):
+        if name == "book":
+            self.book = attrs["id"]
+        elif name == "c":
+            self.chapter = attrs["id"]
+        elif name == "v":
+            self.verse = attrs["id"]
+        elif name == "ve":
+            if self.book is not None and self.chapter is not None and self.verse is not None:
+                verse_buffer = "".join(self.verse_buffer)
+                verse_buffer = verse_buffer.replace("\n", " ")
+                verse_buffer = verse_buffer.replace("\t", " ")
+                verse_buffer = verse_buffer.strip()
+                self.writer.writerow([self.book, self.chapter, self.verse, verse_buffer])
+            self.verse = None
+            self.verse_buffer = []
+
+    def text(self, s):
+        if self.book is not None and self.chapter is not None and self.verse is not None:
+            self.verse_buffer.append(" " + s.strip())
+
+
+class _StreamingTarget:
+    """
+    lxml parser target which forwards events to a VerseRowWriter, dropping SKIPPED_TAGS subtrees on the fly.
+    Adjacent character data is coalesced into one text node, and any other event ends a text node, mirroring
+    how BeautifulSoup builds NavigableStrings from the same parser.
+    """
+
+    def __init__(self, rows: VerseRowWriter):
+        self.rows = rows
+        self.skip_depth = 0
+        self.pending = []
+
+    def _end_data(self):
+        if self.pending:
+            if self.skip_depth == 0:
+                self.rows.text("".join(self.pending))
+            self.pending = []
+
+    def start(self, tag, attrib):
+        self._end_data()
+        if self.skip_depth > 0 or tag in SKIPPED_TAGS:
+            self.skip_depth += 1
+        else:
+            self.rows.element(tag, attrib)
+
+    def end(self, tag):
+        self._end_data()
+        if self.skip_depth > 0:
+            self.skip_depth -= 1
+
+    def data(self, data):
+        self.pending.append(data)
+
+    def comment(self, text):
+        self._end_data()
+        if self.skip_depth == 0:
+            self.rows.text(text)
+
+    def pi(self, target, data=None):
+        self._end_data()
+
+    def doctype(self, *args):
+        self._end_data()
+
+    def close(self):
+        self._end_data()
+
+
+def convert_streaming(input_path: str, output_path: str) -> None:
+    """
+    Convert a USFX file to TSV while reading it incrementally, so memory use does not grow with the input.
+    Uses the same lxml HTML parser that BeautifulSoup uses in `convert_dom`, so the element structure (and
+    therefore the output) is the same.
+    """
+    with open(input_path, "r") as fin, open(output_path, "w", newline="") as fout:
+        parser = etree.HTMLParser(target=_StreamingTarget(VerseRowWriter(fout)), recover=True)
+        while chunk := fin.read(CHUNK_SIZE):
+            parser.feed(chunk)
+        parser.close()
 
-if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Provide input path and output path as arguments.")
-        sys.exit(1)
 
-    with open(sys.argv[1], "r") as f:
+def convert_dom(input_path: str, output_path: str) -> None:
+    """
+    Convert a USFX file to TSV by building the whole document with BeautifulSoup first.
+    """
+    with open(input_path, "r") as f:
         xml = BeautifulSoup(f.read(), features="lxml")
 
-    def remove_all_tags(tag_name):
+    for tag_name in SKIPPED_TAGS:
         for x in xml.find_all(tag_name):
             x.decompose()
 
-    # see https://ebible.org/usfx/usfx.htm
-    remove_all_tags("h")  # header
-    remove_all_tags("f")  # footnote
-    remove_all_tags("cl")  # chapter label
-    remove_all_tags("generated")  # generated content
-    remove_all_tags("ref")  # reference
-
-    with open(sys.argv[2], "w", newline="") as f:
-        writer = csv.writer(f, delimiter="\t", lineterminator="\n")
-        book = None
-        chapter = None
-        verse = None
-        verse_buffer = ""
+    with open(output_path, "w", newline="") as f:
+        rows = VerseRowWriter(f)
         for child in xml.recursiveChildGenerator():
             name = child.name
-            if name == "book":
-                book = child.attrs["id"]
-            elif name == "c":
-                chapter = child.attrs["id"]
-            elif name == "v":
-                verse = child.attrs["id"]
-            elif name == "ve":
-                if book is not None and chapter is not None and verse is not None:
-                    verse_buffer = verse_buffer.replace("\n", " ")
-                    verse_buffer = verse_buffer.replace("\t", " ")
-                    verse_buffer = verse_buffer.strip()
-                    writer.writerow([book, chapter, verse, verse_buffer])
-                verse = None
-                verse_buffer = ""
-            elif name is None and not isinstance(child, bs4.element.ProcessingInstruction):
-                if book is not None and chapter is not None and verse is not None:
-                    verse_buffer += " " + str(child).strip()
+            if name is not None:
+                rows.element(name, child.attrs)
+            elif not isinstance(child, bs4.element.ProcessingInstruction):
+                rows.text(str(child))
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def batch_jobs(input_path: str, output_dir: str, usfx_dir: str) -> List[Tuple[str, str, str]]:
+    """
+    List (bible id, USFX path, TSV path) for every Bible in a corpus. `input_path` is either a directory of
+    `{id}_usfx.xml` files or a TSV whose first column is a Bible id, in which case the USFX files are looked up
+    in `usfx_dir`. Outputs are named `{id}-bible.tsv`, as in BUILD.md.
+    """
+    if os.path.isdir(input_path):
+        suffix = "_usfx.xml"
+        ids = sorted(name[: -len(suffix)] for name in os.listdir(input_path) if name.endswith(suffix))
+        usfx_dir = input_path
+    else:
+        with open(input_path, "r") as f:
+            ids = [line.split("\t")[0].strip() for line in f if line.strip() != ""]
+    return [
+        (bible_id, os.path.join(usfx_dir, f"{bible_id}_usfx.xml"), os.path.join(output_dir, f"{bible_id}-bible.tsv"))
+        for bible_id in ids
+    ]
+
+
+def _is_up_to_date(input_path, output_path, recorded_digest):
+    if not os.path.exists(output_path):
+        return False
+    if os.path.getmtime(output_path) >= os.path.getmtime(input_path):
+        return True
+    # The input was touched after the output was written; it only needs redoing if its contents changed
+    return recorded_digest is not None and recorded_digest == file_digest(input_path)
+
+
+def _convert_job(input_path, output_path):
+    start = time.perf_counter()
+    # written under a temporary name and moved into place when complete, so that a process which is killed
+    # midway never leaves a truncated TSV that looks up to date
+    tmp_path = output_path + ".tmp"
+    try:
+        convert_streaming(input_path, tmp_path)
+        os.replace(tmp_path, output_path)
+        return file_digest(input_path), time.perf_counter() - start, None
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None, time.perf_counter() - start, traceback.format_exc(limit=1).strip().replace("\n", " ")
+
+
+def convert_batch(input_path: str, output_dir: str, usfx_dir: str, workers: int, force: bool = False):
+    """
+    Convert every Bible in a corpus (see `batch_jobs`) using a pool of `workers` processes. Bibles whose TSV
+    is newer than their USFX file, or whose USFX contents are unchanged since the last batch run, are skipped
+    unless `force` is set. A per-file timing and error summary is written to `output_dir`.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+
+    summary = []
+    pending = []
+    for bible_id, usfx_path, tsv_path in batch_jobs(input_path, output_dir, usfx_dir):
+        if not os.path.exists(usfx_path):
+            summary.append((bible_id, "failed", 0.0, f"No such file: {usfx_path}"))
+        elif not force and _is_up_to_date(usfx_path, tsv_path, manifest.get(bible_id)):
+            summary.append((bible_id, "skipped", 0.0, ""))
+        else:
+            pending.append((bible_id, usfx_path, tsv_path))
+
+    print(f"Converting {len(pending)} of {len(pending) + len(summary)} Bibles with {workers} workers")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_convert_job, u, t): bible_id for bible_id, u, t in pending}
+        for future in as_completed(futures):
+            bible_id = futures[future]
+            try:
+                digest, seconds, error = future.result()
+            except Exception as e:
+                # e.g. BrokenProcessPool, if a worker was killed
+                digest, seconds, error = None, 0.0, repr(e)
+            if error is None:
+                manifest[bible_id] = digest
+                summary.append((bible_id, "converted", seconds, ""))
+            else:
+                manifest.pop(bible_id, None)
+                summary.append((bible_id, "failed", seconds, error))
+                print(f"Failed to convert {bible_id}: {error}")
+
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    summary.sort(key=lambda x: x[0])
+    with open(os.path.join(output_dir, SUMMARY_NAME), "w") as f:
+        f.write("id\tstatus\tseconds\terror\n")
+        for bible_id, status, seconds, error in summary:
+            f.write(f"{bible_id}\t{status}\t{seconds:.2f}\t{error}\n")
+
+    counts = {status: sum(1 for x in summary if x[1] == status) for status in ["converted", "skipped", "failed"]}
+    total = sum(x[2] for x in summary)
+    print(
+        f"Converted {counts['converted']}, skipped {counts['skipped']}, failed {counts['failed']}"
+        f" ({total:.1f}s of conversion time). See {os.path.join(output_dir, SUMMARY_NAME)}"
+    )
+    return summary
+
+
+@click.command
+@click.argument("input_path")
+@click.argument("output_path")
+@click.option(
+    "--streaming/--no-streaming",
+    default=True,
+    help="Parse incrementally instead of building the whole document in memory with BeautifulSoup",
+)
+@click.option(
+    "--batch",
+    is_flag=True,
+    help="Treat INPUT_PATH as a directory of *_usfx.xml files or a languages TSV, and OUTPUT_PATH as a directory",
+)
+@click.option("--usfx-dir", default="data/usfx", help="Where to find USFX files when INPUT_PATH is a languages TSV")
+@click.option("-j", "--workers", default=os.cpu_count(), type=int, help="Processes to use in batch mode")
+@click.option("--force", is_flag=True, help="In batch mode, convert even if an output is up to date")
+def run(input_path, output_path, streaming, batch, usfx_dir, workers, force):
+    if batch:
+        convert_batch(input_path, output_path, usfx_dir, workers, force)
+    elif streaming:
+        convert_streaming(input_path, output_path)
+    else:
+        convert_dom(input_path, output_path)
+
+
+if __name__ == "__main__":
+    run()
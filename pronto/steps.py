@@ -1,13 +1,24 @@
+import os
+import resource
+import time
+from logging import getLogger
+from multiprocessing import get_context
 from os import makedirs
 from shutil import rmtree
-from typing import List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 from onf_parser import Section, parse_files
-from tango import DillFormat, Step
+from tango import DillFormat, JsonFormat, Step
 
-from pronto.aligning import AlignedVerse, align_verses
+from pronto.aligning import AlignedVerse, align_verses_to_index, index_ontonotes
+from pronto.eval.tasks._ud import UdParses, UdParsesFormat, parse_verses
+from pronto.ontonotes_index import OntonotesVerseIndex, OntonotesVerseIndexFormat
 from pronto.reading import Book, read_bible_tsv
-from pronto.tasks.spec import TaskSpec
+from pronto.tasks.features import VerseFeatures, VerseFeaturesFormat, build_verse_features
+from pronto.tasks.propositions import PropositionIndex, PropositionIndexFormat, build_proposition_index
+from pronto.tasks.spec import TaskData, TaskDataFormat, TaskSpec, resources_for, run_task_spec
+
+logger = getLogger(__name__)
 
 
 @Step.register("pronto.steps::read_ontonotes")
@@ -20,8 +31,24 @@ class ReadOntonotes(Step):
         return parse_files(path)
 
 
+@Step.register("pronto.steps::index_ontonotes")
+class IndexOntonotes(Step):
+    """
+    Parse OntoNotes and keep only the verse index that alignment needs. Unlike `read_ontonotes`, the result
+    is cached in a compact format which loads its index immediately and its sentences on demand.
+    """
+
+    DETERMINISTIC = True
+    CACHEABLE = True
+    FORMAT = OntonotesVerseIndexFormat()
+
+    def run(self, path: str) -> OntonotesVerseIndex:
+        return index_ontonotes(parse_files(path))
+
+
 @Step.register("pronto.steps::read_bible_tsv")
 class ReadBibleTsv(Step):
+    VERSION = "002"
     DETERMINISTIC = True
     CACHEABLE = True
     FORMAT = DillFormat()
@@ -32,23 +59,332 @@ class ReadBibleTsv(Step):
 
 @Step.register("pronto.steps::align_verses")
 class AlignVerses(Step):
+    """
+    Align the Bible's verses to OntoNotes. With `manifest_path`, the step keeps an alignment manifest there
+    (see `pronto.aligning.AlignmentManifest`), so that when the step reruns because the Bible changed, only
+    the books which changed are aligned again, and the manifest lists the verse references which changed.
+    """
+
+    VERSION = "003"
     DETERMINISTIC = True
     CACHEABLE = True
     FORMAT = DillFormat()
+    # the manifest only changes how alignment is done, not the aligned verses
+    SKIP_ID_ARGUMENTS = {"manifest_path"}
 
     def run(
-        self, ontonotes_data: List[Tuple[str, List[Section]]], bible_data: List[Book], threshold: int = 500
+        self,
+        bible_data: List[Book],
+        ontonotes_data: Optional[List[Tuple[str, List[Section]]]] = None,
+        ontonotes_index: Optional[OntonotesVerseIndex] = None,
+        threshold: int = 500,
+        manifest_path: Optional[str] = None,
     ) -> List[AlignedVerse]:
-        return align_verses(ontonotes_data, bible_data, threshold)
+        if (ontonotes_data is None) == (ontonotes_index is None):
+            raise ValueError("Exactly one of ontonotes_data and ontonotes_index must be provided")
+        if ontonotes_index is None:
+            ontonotes_index = index_ontonotes(ontonotes_data)
+        return align_verses_to_index(ontonotes_index, bible_data, threshold, manifest_path)
+
+
+@Step.register("pronto.steps::parse_ud")
+class ParseUd(Step):
+    """
+    Parse the target-language side of the aligned verses with stanza once, in batches, so that every UD-based
+    task spec can share the parses instead of running its own pipeline verse by verse.
+    """
+
+    DETERMINISTIC = True
+    CACHEABLE = True
+    FORMAT = UdParsesFormat()
+    # these only affect how parsing is done, not the parses
+    SKIP_ID_ARGUMENTS = {"batch_size", "cache_path", "cache_max_entries"}
+
+    def run(
+        self,
+        verses: List[AlignedVerse],
+        language: str,
+        batch_size: int = 256,
+        cache_path: Optional[str] = None,
+        cache_max_entries: Optional[int] = None,
+    ) -> UdParses:
+        return parse_verses(verses, language, batch_size, cache_path, cache_max_entries)
+
+
+@Step.register("pronto.steps::verse_features")
+class BuildVerseFeatures(Step):
+    """
+    Compute the per-verse OntoNotes features that several task specs filter on (see
+    `pronto.tasks.features.VerseFeatures`) in a single pass over the aligned verses.
+    """
+
+    DETERMINISTIC = True
+    CACHEABLE = True
+    FORMAT = VerseFeaturesFormat()
+
+    def run(self, verses: List[AlignedVerse], subject_tag: str = "NP-SBJ") -> VerseFeatures:
+        return build_verse_features(verses, subject_tag)
+
+
+@Step.register("pronto.steps::proposition_index")
+class BuildPropositionIndex(Step):
+    """
+    Index the PropBank annotations of the aligned verses once (see `pronto.tasks.propositions.PropositionIndex`),
+    so that sense-based task specs with different sampling configurations need not rescan them.
+    """
+
+    DETERMINISTIC = True
+    CACHEABLE = True
+    FORMAT = PropositionIndexFormat()
+
+    def run(self, verses: List[AlignedVerse]) -> PropositionIndex:
+        return build_proposition_index(verses)
+
+
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _process_task_spec(
+    spec: TaskSpec, verses: List[AlignedVerse], output_dir: str, resources: Dict[str, Any], forked: bool = False
+) -> Dict[str, Any]:
+    start = time.perf_counter()
+    start_rss = _peak_rss_mb()
+    rows = spec.process(verses, output_dir, **resources_for(spec, resources))
+    report = {"task": type(spec).__name__, "seconds": time.perf_counter() - start}
+    # a forked worker runs a single spec, so its peak is the spec's; in this process, the peak covers
+    # everything run before, so only how far the spec raised it is reported
+    if forked:
+        report["peak_rss_mb"] = _peak_rss_mb()
+    else:
+        report["peak_rss_growth_mb"] = _peak_rss_mb() - start_rss
+    # streaming specs report how many rows they wrote to each split
+    if rows is not None:
+        report["rows"] = rows
+    return report
+
+
+def _log_task_report(report: Dict[str, Any]) -> None:
+    rows = f", rows {report['rows']}" if "rows" in report else ""
+    if "peak_rss_mb" in report:
+        memory = f"peak RSS {report['peak_rss_mb']:.0f} MB"
+    else:
+        memory = f"peak RSS +{report['peak_rss_growth_mb']:.0f} MB"
+    logger.info(f"{report['task']}: {report['seconds']:.1f}s, {memory}{rows}")
+
+
+# Shared resources which generate_task_data builds itself when a spec uses them and none was passed
+_RESOURCE_BUILDERS = {
+    "verse_features": build_verse_features,
+    "proposition_index": build_proposition_index,
+}
+
+# State shared with forked workers of generate_task_data, set before the pool is created (see
+# _SHARED_LANGUAGE_STATE below)
+_SHARED_TASK_STATE = None
+
+
+def _process_shared_task_spec(i: int) -> Dict[str, Any]:
+    task_specs, verses, output_dir, resources = _SHARED_TASK_STATE
+    return _process_task_spec(task_specs[i], verses, output_dir, resources, forked=True)
+
+
+def generate_task_data(
+    task_specs: List[TaskSpec],
+    verses: List[AlignedVerse],
+    output_dir: str,
+    ud_parses: Optional[UdParses] = None,
+    max_workers: int = 1,
+    verse_features: Optional[VerseFeatures] = None,
+    proposition_index: Optional[PropositionIndex] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Run each task spec over the verses, returning each one's wall time, memory use and, for specs which stream
+    their rows (see `pronto.tasks.spec.StreamingTaskSpec`), row counts per split. With `max_workers` above
+    1, specs run concurrently in forked processes which share `verses` copy-on-write. Each worker handles a
+    single spec, so its `peak_rss_mb` is that of the spec alone (plus what it inherited from this process).
+    Specs run in this process instead report `peak_rss_growth_mb`, how far each raised the process's peak RSS.
+
+    If `verse_features` or `proposition_index` is not given but some spec uses it, it is built once here and
+    shared.
+    """
+    global _SHARED_TASK_STATE
+
+    rmtree(output_dir, ignore_errors=True)
+    makedirs(output_dir)
+    resources = {"ud_parses": ud_parses, "verse_features": verse_features, "proposition_index": proposition_index}
+    for name, build in _RESOURCE_BUILDERS.items():
+        if resources[name] is None and any(name in s.RESOURCES for s in task_specs):
+            resources[name] = build(verses)
+    if max_workers == 1 or len(task_specs) <= 1:
+        report = [_process_task_spec(s, verses, output_dir, resources) for s in task_specs]
+    else:
+        _SHARED_TASK_STATE = (task_specs, verses, output_dir, resources)
+        try:
+            with get_context("fork").Pool(max_workers, maxtasksperchild=1) as pool:
+                report = pool.map(_process_shared_task_spec, range(len(task_specs)), chunksize=1)
+        finally:
+            _SHARED_TASK_STATE = None
+
+    for r in report:
+        _log_task_report(r)
+    return report
 
 
 @Step.register("pronto.steps::generate_task_data")
 class GenerateTaskData(Step):
+    """
+    Write task data for every spec to `output_dir`. Returns each spec's wall time, memory use and row counts;
+    see `generate_task_data`.
+    """
+
+    VERSION = "005"
+    DETERMINISTIC = True
+    CACHEABLE = True
+    FORMAT = JsonFormat()
+    SKIP_ID_ARGUMENTS = {"max_workers"}
+
+    def run(
+        self,
+        task_specs: List[TaskSpec],
+        verses: List[AlignedVerse],
+        output_dir: str,
+        ud_parses: Optional[UdParses] = None,
+        max_workers: int = 1,
+        verse_features: Optional[VerseFeatures] = None,
+        proposition_index: Optional[PropositionIndex] = None,
+    ) -> List[Dict[str, Any]]:
+        return generate_task_data(
+            task_specs, verses, output_dir, ud_parses, max_workers, verse_features, proposition_index
+        )
+
+
+@Step.register("pronto.steps::run_task_spec")
+class RunTaskSpec(Step):
+    """
+    Run a single task spec and cache the files it writes. Unlike `generate_task_data`, a config with one of
+    these steps per spec only reruns the specs whose parameters or `VERSION` changed, and leaves writing to
+    the output directory to `pronto.steps::materialize_task_data`. Specs run concurrently when Tango's
+    multicore executor is used (see tango.yml), and each logs its wall time and how far it raised its
+    process's peak RSS.
+    """
+
     DETERMINISTIC = True
     CACHEABLE = True
+    FORMAT = TaskDataFormat()
+
+    def run(
+        self,
+        task_spec: TaskSpec,
+        verses: List[AlignedVerse],
+        ud_parses: Optional[UdParses] = None,
+        verse_features: Optional[VerseFeatures] = None,
+        proposition_index: Optional[PropositionIndex] = None,
+    ) -> TaskData:
+        resources = {"ud_parses": ud_parses, "verse_features": verse_features, "proposition_index": proposition_index}
+        start = time.perf_counter()
+        start_rss = _peak_rss_mb()
+        task_data = run_task_spec(task_spec, verses, **resources_for(task_spec, resources))
+        _log_task_report(
+            {
+                "task": type(task_spec).__name__,
+                "seconds": time.perf_counter() - start,
+                "peak_rss_growth_mb": _peak_rss_mb() - start_rss,
+            }
+        )
+        return task_data
+
 
-    def run(self, task_specs: List[TaskSpec], verses: List[AlignedVerse], output_dir: str):
+@Step.register("pronto.steps::materialize_task_data")
+class MaterializeTaskData(Step):
+    """
+    Write the outputs of `pronto.steps::run_task_spec` steps to `output_dir`, replacing whatever was there.
+    """
+
+    DETERMINISTIC = True
+    CACHEABLE = False
+
+    def run(self, task_data: List[TaskData], output_dir: str) -> None:
         rmtree(output_dir, ignore_errors=True)
         makedirs(output_dir)
-        for s in task_specs:
-            s.process(verses, output_dir)
+        written = set()
+        for files in task_data:
+            for name, contents in files.items():
+                if name in written:
+                    raise ValueError(f"More than one task spec wrote {name}")
+                written.add(name)
+                with open(os.path.join(output_dir, name), "wb") as f:
+                    f.write(contents)
+
+
+# State shared with forked workers of GenerateAllLanguages. Set before the pool is created so that children
+# inherit it copy-on-write instead of receiving a pickled copy of OntoNotes per task.
+_SHARED_LANGUAGE_STATE = None
+
+
+def _generate_language(language: str, bible_path: str, output_dir: str, manifest_path: Optional[str]) -> str:
+    ontonotes_verse_index, task_specs, threshold = _SHARED_LANGUAGE_STATE
+    try:
+        verses = align_verses_to_index(ontonotes_verse_index, read_bible_tsv(bible_path), threshold, manifest_path)
+        generate_task_data(task_specs, verses, output_dir)
+        return "ok"
+    except Exception as e:
+        logger.exception(f"Failed to generate task data for {language}")
+        return f"{type(e).__name__}: {e}"
+
+
+@Step.register("pronto.steps::generate_all_languages")
+class GenerateAllLanguages(Step):
+    """
+    Generate task data for many Bibles in one run. The OntoNotes index is loaded once and shared with a
+    pool of forked workers, each of which reads, aligns and processes one Bible at a time. The Bible for
+    language `x` is read from `{bible_dir}/x-bible.tsv` and its task data is written to `{output_dir}/x`.
+    Languages are taken from the first column of `languages_path`. If `manifest_dir` is given, each language
+    keeps an alignment manifest (see `pronto.aligning.AlignmentManifest`) at `{manifest_dir}/x.json`.
+
+    Returns a mapping from each language to "ok" or to the error which stopped it. Since the step reads Bibles
+    by path and writes its output as a side effect, like `pronto.steps::materialize_task_data`, it is not
+    cached.
+    """
+
+    DETERMINISTIC = True
+    CACHEABLE = False
+
+    def run(
+        self,
+        ontonotes_index: OntonotesVerseIndex,
+        task_specs: List[TaskSpec],
+        languages_path: str,
+        bible_dir: str,
+        output_dir: str,
+        threshold: int = 500,
+        max_workers: Optional[int] = None,
+        manifest_dir: Optional[str] = None,
+    ) -> Dict[str, str]:
+        global _SHARED_LANGUAGE_STATE
+
+        with open(languages_path, "r") as f:
+            languages = [line.split("\t")[0].strip() for line in f if line.strip() != ""]
+        jobs = [
+            (
+                language,
+                os.path.join(bible_dir, f"{language}-bible.tsv"),
+                os.path.join(output_dir, language),
+                os.path.join(manifest_dir, f"{language}.json") if manifest_dir is not None else None,
+            )
+            for language in languages
+        ]
+
+        _SHARED_LANGUAGE_STATE = (ontonotes_index.load_all(), task_specs, threshold)
+        try:
+            with get_context("fork").Pool(max_workers) as pool:
+                statuses = pool.starmap(_generate_language, jobs, chunksize=1)
+        finally:
+            _SHARED_LANGUAGE_STATE = None
+
+        results = {job[0]: status for job, status in zip(jobs, statuses)}
+        failed = [language for language, status in results.items() if status != "ok"]
+        logger.info(f"Generated task data for {len(results) - len(failed)} of {len(results)} languages")
+        if len(failed) > 0:
+            logger.warning(f"Failed languages: {failed}")
+        return results
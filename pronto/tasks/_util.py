@@ -1,12 +1,127 @@
+import hashlib
 import random
-from typing import Dict, List, Tuple
+from bisect import bisect_right
+from collections import defaultdict
+from collections.abc import Sequence
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 import nltk
 
+_NO_MATCH = (None, ())
+
+
+@lru_cache(maxsize=None)
+def _compile_label_matcher(blocker_keys: Tuple[str, ...], targets: Tuple[str, ...]):
+    """
+    Return a memoized function mapping a node label to the index of the blocker it matches (the last matching
+    key, or None) and the indexes of the targets it contains.
+    """
+    memo = {}
+
+    def match(label: str) -> Tuple[Optional[int], Tuple[int, ...]]:
+        result = memo.get(label)
+        if result is None:
+            supertype = label.split("-")[0]
+            blocker_index = None
+            for i, b in enumerate(blocker_keys):
+                if supertype.startswith(b):
+                    blocker_index = i
+            target_indexes = tuple(i for i, t in enumerate(targets) if t in label)
+            result = (blocker_index, target_indexes) if blocker_index is not None or target_indexes else _NO_MATCH
+            memo[label] = result
+        return result
+
+    return match
+
+
+def token_yields_of_tree_node(
+    tree: nltk.tree.Tree, targets: Iterable[str], blockers: Dict[str, int] = {"S": 1}
+) -> Dict[str, List[Tuple[int, Tuple[str, ...]]]]:
+    """
+    Like `token_yield_of_tree_node`, but for several targets in a single pass over the tree. Returns a dict
+    from each target to its token yield.
+    """
+    targets = tuple(dict.fromkeys(targets))
+    blocker_keys = tuple(blockers.keys())
+    limits = [blockers[b] for b in blocker_keys]
+    match = _compile_label_matcher(blocker_keys, targets)
+
+    counts = [0] * len(blocker_keys)
+    # number of blockers currently seen more often than allowed; targets may only open while this is 0
+    violations = sum(1 for limit in limits if limit < 0)
+    in_target = [False] * len(targets)
+    active_targets = 0
+    token_yields = [[] for _ in targets]
+    token_num = 0
+
+    # one entry per open tree node: its label, an iterator over its remaining children, and the blocker and
+    # targets it matched. The root sits under an extra iterator which has no label or frame.
+    labels = []
+    path = ()
+    children = [iter((tree,))]
+    frames = []
+    Tree = nltk.tree.Tree
+    while len(children) > 0:
+        for node in children[-1]:
+            if type(node) is str:
+                if active_targets > 0:
+                    if path is None:
+                        path = tuple(labels)
+                    for t, active in enumerate(in_target):
+                        if active:
+                            token_yields[t].append((token_num, path))
+                token_num += 1
+            elif type(node) == Tree:
+                label = node.label()
+                frame = match(label)
+                # fast path for the common case of a preterminal which is neither a blocker nor a target
+                if frame is _NO_MATCH and len(node) == 1 and type(node[0]) is str:
+                    if active_targets > 0:
+                        leaf_path = (*labels, label)
+                        for t, active in enumerate(in_target):
+                            if active:
+                                token_yields[t].append((token_num, leaf_path))
+                    token_num += 1
+                    continue
+                blocker_index, target_indexes = frame
+                if blocker_index is not None:
+                    counts[blocker_index] += 1
+                    if counts[blocker_index] == limits[blocker_index] + 1:
+                        violations += 1
+                if violations == 0:
+                    for t in target_indexes:
+                        if not in_target[t]:
+                            in_target[t] = True
+                            active_targets += 1
+                labels.append(label)
+                path = None
+                children.append(iter(node))
+                frames.append(frame)
+                # descend; the parent's iterator resumes where it left off once this node is exhausted
+                break
+        else:
+            children.pop()
+            if len(frames) == 0:
+                continue
+            labels.pop()
+            path = None
+            blocker_index, target_indexes = frames.pop()
+            if blocker_index is not None:
+                counts[blocker_index] -= 1
+                if counts[blocker_index] == limits[blocker_index]:
+                    violations -= 1
+            for t in target_indexes:
+                if in_target[t]:
+                    in_target[t] = False
+                    active_targets -= 1
+
+    return dict(zip(targets, token_yields))
+
 
 def token_yield_of_tree_node(
     tree: nltk.tree.Tree, target: str, blockers: Dict[str, int] = {"S": 1}
-) -> List[Tuple[int, List[str]]]:
+) -> List[Tuple[int, Tuple[str, ...]]]:
     """
     Given a tree, return a list of 0-indexed tokens which are children of nodes of a particular type,
     indicated by the argument "target".
@@ -32,53 +147,176 @@ def token_yield_of_tree_node(
         A list of tuples with two elements: the first is a 0-indexed token index, and the second is an ancestor
         list for that token.
     """
-    token_num = 0
-    in_target = False
-    token_yield = []
-    blocker_tracker = {b: 0 for b in blockers.keys()}
-
-    def dfs(node, ancestors=()):
-        nonlocal token_num, in_target
-        if type(node) is str:
-            if in_target:
-                token_yield.append((token_num, ancestors))
-            token_num += 1
-        elif type(node) == nltk.tree.Tree:
-            node_type = node.label()
-            node_supertype = node_type.split("-")[0]
-
-            blocker_match = None
-            for b in blockers.keys():
-                if node_supertype.startswith(b):
-                    blocker_match = b
-
-            # pre
-            if is_blocker := blocker_match is not None:
-                blocker_tracker[blocker_match] += 1
-            if is_target := target in node_type:
-                if all(blocker_tracker[b] <= blockers[b] for b in blockers.keys()):
-                    in_target = True
-
-            for x in node:
-                dfs(x, ancestors + (node_type,))
-
-            # post
-            if is_blocker:
-                blocker_tracker[blocker_match] -= 1
-            if is_target:
-                in_target = False
-
-    dfs(tree)
-
-    return token_yield
-
-
-def train_dev_test_split(insts):
+    return token_yields_of_tree_node(tree, (target,), blockers)[target]
+
+
+def is_contiguous(indexes):
+    if len(indexes) == 0:
+        return True
+    for i in range(1, len(indexes)):
+        if indexes[i - 1] != indexes[i] - 1:
+            return False
+    return True
+
+
+SPLITS = ("train", "dev", "test")
+DEFAULT_SPLIT_RATIOS = (0.8, 0.1, 0.1)
+
+
+def check_split_ratios(ratios: Tuple[float, float, float]) -> Tuple[float, float, float]:
+    if len(ratios) != len(SPLITS) or any(r < 0 for r in ratios) or abs(sum(ratios) - 1) > 1e-6:
+        raise ValueError(f"Split ratios must be three non-negative numbers summing to 1, got {ratios}")
+    return tuple(ratios)
+
+
+def train_dev_test_split(insts, ratios: Tuple[float, float, float] = DEFAULT_SPLIT_RATIOS):
+    """
+    Shuffle `insts` in place with a fixed seed and slice it into train, dev and test. This is how splits were
+    made before `SplitAssigner`, and is kept so that released data can be reproduced.
+    """
+    check_split_ratios(ratios)
     random.seed(42)
     random.shuffle(insts)
-    i1 = int(len(insts) * 0.8)
-    i2 = int(len(insts) * 0.9)
+    i1 = int(len(insts) * ratios[0])
+    i2 = int(len(insts) * (ratios[0] + ratios[1]))
     train = insts[:i1]
     dev = insts[i1:i2]
     test = insts[i2:]
     return train, dev, test
+
+
+def stable_fraction(key: str) -> float:
+    """
+    Map a string to a number in [0, 1) which, unlike `hash`, is the same in every process.
+    """
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big") / 2**64
+
+
+class SplitAssigner:
+    """
+    Assigns instances to train, dev or test (0, 1 or 2) by a stable hash of a key, such as a verse reference or
+    a pair of them, in proportion to `ratios`. An instance's split depends only on its key, so instances can be
+    assigned one at a time as they are generated, and adding or removing verses leaves every other instance
+    where it was.
+    """
+
+    def __init__(self, ratios: Tuple[float, float, float] = DEFAULT_SPLIT_RATIOS):
+        self.ratios = check_split_ratios(ratios)
+        self.bounds = (ratios[0], ratios[0] + ratios[1])
+
+    def __call__(self, key: str) -> int:
+        x = stable_fraction(key)
+        return 0 if x < self.bounds[0] else 1 if x < self.bounds[1] else 2
+
+
+# A pair of verses drawn by a sense-pair task: (sense label, verse index, verse index, "same" or "different")
+Pair = Tuple[str, int, int, str]
+
+
+# The row a sense-pair task writes for a pair: (sense label, text, text, relation, reference, reference)
+PairRow = Tuple[str, str, str, str, str, str]
+PAIR_COLUMNS = ("label", "text1", "text2", "relation", "reference1", "reference2")
+# pairs are assigned a split by the references of both verses
+PAIR_KEY_COLUMNS = (4, 5)
+
+
+def pairs_per_instance(config, later: int, others: int) -> int:
+    """
+    How many pairs a sense-pair task draws for one verse, given how many verses after it are in its group and how
+    many verses outside the group are left to draw negative examples from. This only depends on these sizes, so
+    tasks can count their pairs without drawing them.
+    """
+    positive = min(config.positive_pairs_per_instance, later)
+    return positive + min(config.negative_per_positive * positive, positive, others)
+
+
+def label_quotas(counts: Dict[str, int], budget: int) -> Dict[str, int]:
+    """
+    Share `budget` among labels in proportion to how many pairs they have, by largest remainder. Every label with
+    pairs gets at least one if the budget allows it.
+    """
+    labels = [label for label, count in counts.items() if count > 0]
+    if sum(counts.values()) <= budget:
+        return dict(counts)
+    floor = 1 if budget >= len(labels) else 0
+    quotas = {label: floor for label in labels}
+    spare = sum(counts[label] - floor for label in labels)
+    shares = {label: (budget - floor * len(labels)) * (counts[label] - floor) / spare for label in labels}
+    for label, share in shares.items():
+        quotas[label] += int(share)
+    leftover = budget - sum(quotas.values())
+    for label in sorted(labels, key=lambda label: int(shares[label]) - shares[label])[:leftover]:
+        quotas[label] += 1
+    return quotas
+
+
+def thin_by_label(pairs: Iterable[Pair], counts: Dict[str, int], budget: Optional[int]) -> Iterator[Pair]:
+    """
+    Yield evenly spaced pairs of each label, as many as its quota of `budget` (see `label_quotas`). `counts` must
+    give the number of pairs of each label in `pairs`.
+    """
+    if budget is None:
+        yield from pairs
+        return
+    quotas = label_quotas(counts, budget)
+    seen = defaultdict(int)
+    for pair in pairs:
+        label = pair[0]
+        k = seen[label]
+        seen[label] += 1
+        if (k + 1) * quotas[label] // counts[label] > k * quotas[label] // counts[label]:
+            yield pair
+
+
+def pair_rows(
+    pairs: Iterable[Pair],
+    verses: List,
+    counts: Optional[Dict[str, int]] = None,
+    pair_budget: Optional[int] = None,
+) -> Iterator[PairRow]:
+    """
+    Yield the rows of the pairs of a sense-pair task.
+
+    If `pair_budget` is set and more pairs than that are drawn, only `pair_budget` of them are yielded: evenly
+    spaced pairs of each label, with the budget shared among labels by `label_quotas`. `counts` must then give the
+    number of pairs of each label, which tasks compute from their index (see `pairs_per_instance`).
+    """
+    for label, i, j, relation in thin_by_label(pairs, counts, pair_budget):
+        yield label, verses[i].verse.body, verses[j].verse.body, relation, verses[i].reference, verses[j].reference
+
+
+def concatenate_with_positions(blocks: Iterable[List[int]]) -> Tuple[List[int], Dict[int, List[int]]]:
+    """
+    Concatenate lists of verse indexes, and also return where each verse index occurs in the concatenation.
+    """
+    flat = []
+    positions = defaultdict(list)
+    for block in blocks:
+        for v in block:
+            positions[v].append(len(flat))
+            flat.append(v)
+    return flat, positions
+
+
+class ExcludingSequence(Sequence):
+    """
+    Read-only view of `items` with the items at `excluded_positions` left out, equivalent to (but much cheaper
+    to build than) `[x for i, x in enumerate(items) if i not in excluded_positions]`. Since `random.sample` only
+    depends on a population's length and on which positions it draws, sampling from this view is identical to
+    sampling from the equivalent list under the same seed.
+    """
+
+    def __init__(self, items: List[int], excluded_positions: Iterable[int]):
+        self.items = items
+        # number of non-excluded items which precede each excluded position
+        self.before = [p - k for k, p in enumerate(sorted(set(excluded_positions)))]
+
+    def __len__(self):
+        return len(self.items) - len(self.before)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.items[i + bisect_right(self.before, i)]
@@ -0,0 +1,128 @@
+import json
+import re
+from functools import lru_cache
+from logging import getLogger
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from onf_parser import Mention
+from tango import Format
+from tango.common import PathOrStr
+
+from pronto.aligning import AlignedVerse
+from pronto.tasks._util import is_contiguous, token_yield_of_tree_node
+
+logger = getLogger(__name__)
+
+PRONOUN_PATTERN = re.compile(
+    r"i|me|my|mine|myself"
+    r"|we|our|ours|ourselves"
+    r"|thou|thy|thine|thyself"
+    r"|you|your|yours|yourself|yourselves"
+    r"|he|him|his|himself"
+    r"|she|her|hers|herself"
+    r"|it|its|itself"
+    r"|they|them|their|theirs|themself|themselves",
+    flags=re.IGNORECASE,
+)
+
+VERSE_FEATURES_DTYPE = np.dtype(
+    [
+        ("reference", "U64"),
+        ("cross_verse", "?"),
+        # mentions which are not a single pronoun
+        ("nonpronominal_mentions", "i4"),
+        # 1 or 0 for whether the subject of the first sentence contains a proper noun; -1 if it has no usable
+        # subject, if the verse is cross-verse, or if the table was built without a subject tag
+        ("subject_proper_noun", "i1"),
+        # the label of the first sentence's root clause, or "" if the verse is cross-verse
+        ("root_label", "U32"),
+    ]
+)
+
+
+@lru_cache(maxsize=None)
+def _is_pronoun_token(token: str) -> bool:
+    return re.match(PRONOUN_PATTERN, token) is not None
+
+
+def is_pronominal(mention: Mention):
+    # Discard null tokens
+    tokens = [t for t in mention.tokens if "*" not in t]
+    return len(tokens) == 1 and _is_pronoun_token(tokens[0])
+
+
+def _subject_proper_noun(verse: AlignedVerse, parsed_tree, subject_tag: str) -> int:
+    subject_tokens = token_yield_of_tree_node(parsed_tree, subject_tag)
+    if len(subject_tokens) == 0:
+        logger.debug(f"Couldn't find a subject for verse: {(verse.book, verse.chapter, verse.verse_id)}")
+        return -1
+    if not is_contiguous([x[0] for x in subject_tokens]):
+        logger.warning(
+            f"Skipping verse because subject token indices were not contiguous: {(verse.book, verse.chapter, verse.verse_id)}"
+        )
+        return -1
+    return 1 if any(t[1][-1] in ["NNP", "NNPS"] for t in subject_tokens) else 0
+
+
+class VerseFeatures:
+    """
+    Per-verse features of the OntoNotes side of aligned verses, as a NumPy structured array with one row per
+    verse, in the order of the aligned verses it was built from (see `VERSE_FEATURES_DTYPE`). Tasks select
+    and project rows of it instead of walking the OntoNotes annotations themselves.
+    """
+
+    def __init__(self, table: np.ndarray, subject_tag: Optional[str]):
+        self.table = table
+        self.subject_tag = subject_tag
+
+    def __len__(self):
+        return len(self.table)
+
+    def check(self, verses: List[AlignedVerse]) -> None:
+        if len(verses) != len(self.table) or any(v.reference != r for v, r in zip(verses, self.table["reference"])):
+            raise ValueError("Verse features were built from different aligned verses")
+
+
+def build_verse_features(verses: List[AlignedVerse], subject_tag: Optional[str] = "NP-SBJ") -> VerseFeatures:
+    """
+    Compute every verse's features in one pass, parsing the tree of each verse's first sentence only once.
+    With `subject_tag=None`, the subject proper noun column, which is the only one that needs the tree's token
+    yields, is left at -1.
+    """
+    table = np.zeros(len(verses), dtype=VERSE_FEATURES_DTYPE)
+    for i, verse in enumerate(verses):
+        row = table[i]
+        row["reference"] = verse.reference
+        row["cross_verse"] = verse.is_cross_verse
+        row["nonpronominal_mentions"] = sum(1 for m in verse.mentions if not is_pronominal(m))
+        if verse.is_cross_verse:
+            row["subject_proper_noun"] = -1
+            continue
+        parsed_tree = verse.ontonotes_sentences[0].tree.parsed_tree
+        if subject_tag is None:
+            row["subject_proper_noun"] = -1
+        else:
+            row["subject_proper_noun"] = _subject_proper_noun(verse, parsed_tree, subject_tag)
+        row["root_label"] = parsed_tree[0].label()
+    return VerseFeatures(table, subject_tag)
+
+
+@Format.register("pronto::verse_features")
+class VerseFeaturesFormat(Format[VerseFeatures]):
+    """
+    Stores `VerseFeatures` as `features.npy`, which is memory-mapped when read, and `meta.json`.
+    """
+
+    VERSION = "001"
+
+    def write(self, artifact: VerseFeatures, dir: PathOrStr):
+        np.save(Path(dir) / "features.npy", artifact.table)
+        with open(Path(dir) / "meta.json", "w") as f:
+            json.dump({"subject_tag": artifact.subject_tag}, f)
+
+    def read(self, dir: PathOrStr) -> VerseFeatures:
+        with open(Path(dir) / "meta.json", "r") as f:
+            meta = json.load(f)
+        return VerseFeatures(np.load(Path(dir) / "features.npy", mmap_mode="r"), meta["subject_tag"])
@@ -1,61 +1,43 @@
-from logging import getLogger
-from pathlib import Path
-from typing import List
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
 
 from pronto.aligning import AlignedVerse
-from pronto.tasks._util import token_yield_of_tree_node, train_dev_test_split
-from pronto.tasks.spec import TaskSpec
-
-logger = getLogger(__name__)
-
-
-def is_contiguous(indexes):
-    if len(indexes) == 0:
-        return True
-    for i in range(1, len(indexes)):
-        if indexes[i - 1] != indexes[i] - 1:
-            return False
-    return True
-
-
-def process_verse(verse, subject_tag):
-    first_sentence = verse.ontonotes_sentences[0]
-    parsed_tree = first_sentence.tree.parsed_tree
-    subject_tokens = token_yield_of_tree_node(parsed_tree, subject_tag)
-    if len(subject_tokens) == 0:
-        logger.debug(f"Couldn't find a subject for verse: {(verse.book, verse.chapter, verse.verse_id)}")
-        return None
-    if not is_contiguous([x[0] for x in subject_tokens]):
-        logger.warning(
-            f"Skipping verse because subject token indices were not contiguous: {(verse.book, verse.chapter, verse.verse_id)}"
-        )
-        return None
-
-    subject_is_proper_noun = any(t[1][-1] in ["NNP", "NNPS"] for t in subject_tokens)
-    return verse.verse.body, 1 if subject_is_proper_noun else 0, verse.reference
-
-
-def process_verses(verses, output_dir, subject_tag):
-    outputs = []
-    for i, verse in enumerate(verses):
-        if not verse.is_cross_verse:
-            output = process_verse(verse, subject_tag)
-            if output is not None:
-                outputs.append(output)
-
-    with open(Path(output_dir) / Path(f"proper_noun_subject.tsv"), "w") as f:
-        for s, l, r in outputs:
-            f.write(f"{s}\t{l}\t{r}\n")
-    for split, rows in zip(["train", "dev", "test"], train_dev_test_split(outputs)):
-        with open(Path(output_dir) / Path(f"proper_noun_subject_{split}.tsv"), "w") as f:
-            for s, l, r in rows:
-                f.write(f"{s}\t{l}\t{r}\n")
+from pronto.tasks._util import DEFAULT_SPLIT_RATIOS
+from pronto.tasks.features import VerseFeatures, build_verse_features
+from pronto.tasks.spec import StreamingTaskSpec, TaskSpec
+from pronto.tasks.writers import RowWriter
+
+
+def generate_rows(verses, subject_tag, verse_features=None) -> Iterator[Tuple[str, int, str]]:
+    if verse_features is None or verse_features.subject_tag != subject_tag:
+        verse_features = build_verse_features(verses, subject_tag)
+    verse_features.check(verses)
+    table = verse_features.table
+    rows = np.flatnonzero(~table["cross_verse"] & (table["subject_proper_noun"] >= 0))
+    for i, l, r in zip(rows, table["subject_proper_noun"][rows], table["reference"][rows]):
+        yield verses[i].verse.body, int(l), str(r)
 
 
 @TaskSpec.register("proper_noun_subject")
-class ProperNounSubject(TaskSpec):
-    def __init__(self, subject_tag: str = "NP-SBJ"):
+class ProperNounSubject(StreamingTaskSpec):
+    VERSION = "002"
+    RESOURCES = ("verse_features",)
+    NAME = "proper_noun_subject"
+    COLUMNS = ("text", "proper_noun_subject", "reference")
+    WRITE_ALL = True
+
+    def __init__(
+        self,
+        subject_tag: str = "NP-SBJ",
+        split_ratios: Tuple[float, float, float] = DEFAULT_SPLIT_RATIOS,
+        shuffle_split: bool = False,
+        writer: Optional[RowWriter] = None,
+    ):
+        super().__init__(split_ratios, shuffle_split, writer)
         self.subject_tag = subject_tag
 
-    def process(self, verses: List[AlignedVerse], output_dir: str) -> None:
-        process_verses(verses, output_dir, self.subject_tag)
+    def rows(
+        self, verses: List[AlignedVerse], verse_features: Optional[VerseFeatures] = None
+    ) -> Iterator[Tuple[str, int, str]]:
+        return generate_rows(verses, self.subject_tag, verse_features)
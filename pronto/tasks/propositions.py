@@ -0,0 +1,139 @@
+import json
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+from tango import Format
+from tango.common import PathOrStr
+
+from pronto.aligning import AlignedVerse
+
+PROPOSITIONS_DTYPE = np.dtype(
+    [
+        # index of the aligned verse the proposition occurs in
+        ("verse", "i4"),
+        # index of the sense label in `PropositionIndex.labels`
+        ("label", "i4"),
+        ("core_args", "i2"),
+        ("adjunct_args", "i2"),
+    ]
+)
+
+
+def count_args(args) -> Tuple[int, int]:
+    """
+    Count a proposition's core and adjunct (ARGM-*) arguments, leaving out links and the predicate itself.
+    """
+    core = adjunct = 0
+    for arg_name in args:
+        if "LINK-" in arg_name or arg_name == "v":
+            continue
+        if "-" in arg_name:
+            adjunct += 1
+        else:
+            core += 1
+    return core, adjunct
+
+
+class PropositionIndex:
+    """
+    Every PropBank annotation of a list of aligned verses, as a NumPy structured array with one row per
+    proposition (see `PROPOSITIONS_DTYPE`), in verse order and then in the order of each verse's
+    `sense_annotations`. Sense labels are numbered in order of first appearance.
+
+    Sense-based tasks query it for the verses of each sense label instead of walking the annotations.
+    """
+
+    def __init__(self, table: np.ndarray, labels: List[str], references: np.ndarray):
+        self.table = table
+        self.labels = labels
+        self.references = references
+
+    def __len__(self):
+        return len(self.table)
+
+    def check(self, verses: List[AlignedVerse]) -> None:
+        if len(verses) != len(self.references) or any(v.reference != r for v, r in zip(verses, self.references)):
+            raise ValueError("Proposition index was built from different aligned verses")
+
+    def _rows(self, singleton_only: bool, allow_duplicate_senses_in_verse: bool) -> np.ndarray:
+        verses = self.table["verse"]
+        counts = np.bincount(verses, minlength=len(self.references))
+        keep = np.ones(len(self.references), dtype=bool)
+        # if we only want verses with a single sense annotation, leave out the rest
+        if singleton_only:
+            keep &= counts == 1
+        if not allow_duplicate_senses_in_verse:
+            pairs = np.unique(verses.astype(np.int64) << 32 | self.table["label"])
+            keep &= np.bincount(pairs >> 32, minlength=len(self.references)) == counts
+        return np.flatnonzero(keep[verses])
+
+    def senses(
+        self, singleton_only: bool = False, allow_duplicate_senses_in_verse: bool = True
+    ) -> Dict[str, List[int]]:
+        """
+        Map sense labels to the indexes of verses which contain them.
+        """
+        rows = self._rows(singleton_only, allow_duplicate_senses_in_verse)
+        index = {}
+        for verse, label in zip(self.table["verse"][rows].tolist(), self.table["label"][rows].tolist()):
+            ids = index.setdefault(label, [])
+            # verses are visited in order, so a verse already in the list can only be at the end of it
+            if len(ids) == 0 or ids[-1] != verse:
+                ids.append(verse)
+        return {self.labels[label]: ids for label, ids in index.items()}
+
+    def arg_counts(
+        self, singleton_only: bool = False, allow_duplicate_senses_in_verse: bool = True, include_adjuncts: bool = True
+    ) -> Dict[str, Dict[int, List[int]]]:
+        """
+        Map sense labels to argument counts to the indexes of verses which contain them.
+        """
+        rows = self._rows(singleton_only, allow_duplicate_senses_in_verse)
+        arg_counts = self.table["core_args"][rows].astype(np.int64)
+        if include_adjuncts:
+            arg_counts += self.table["adjunct_args"][rows]
+        index = {}
+        for verse, label, arg_count in zip(
+            self.table["verse"][rows].tolist(), self.table["label"][rows].tolist(), arg_counts.tolist()
+        ):
+            ids = index.setdefault(label, {}).setdefault(arg_count, [])
+            if len(ids) == 0 or ids[-1] != verse:
+                ids.append(verse)
+        return {self.labels[label]: ids_by_arg_count for label, ids_by_arg_count in index.items()}
+
+
+def build_proposition_index(verses: List[AlignedVerse]) -> PropositionIndex:
+    labels = {}
+    rows = []
+    for i, verse in enumerate(verses):
+        for sense in verse.sense_annotations:
+            rows.append((i, labels.setdefault(sense.label, len(labels)), *count_args(sense.args)))
+    return PropositionIndex(
+        np.array(rows, dtype=PROPOSITIONS_DTYPE), list(labels), np.array([v.reference for v in verses], dtype="U64")
+    )
+
+
+@Format.register("pronto::proposition_index")
+class PropositionIndexFormat(Format[PropositionIndex]):
+    """
+    Stores a `PropositionIndex` as `propositions.npy` and `references.npy`, which are memory-mapped when read,
+    and `labels.json`.
+    """
+
+    VERSION = "001"
+
+    def write(self, artifact: PropositionIndex, dir: PathOrStr):
+        np.save(Path(dir) / "propositions.npy", artifact.table)
+        np.save(Path(dir) / "references.npy", artifact.references)
+        with open(Path(dir) / "labels.json", "w") as f:
+            json.dump(artifact.labels, f, ensure_ascii=False)
+
+    def read(self, dir: PathOrStr) -> PropositionIndex:
+        with open(Path(dir) / "labels.json", "r") as f:
+            labels = json.load(f)
+        return PropositionIndex(
+            np.load(Path(dir) / "propositions.npy", mmap_mode="r"),
+            labels,
+            np.load(Path(dir) / "references.npy", mmap_mode="r"),
+        )
@@ -1,57 +1,45 @@
 import random
-from collections import Counter, defaultdict
+from collections import Counter
 from logging import getLogger
-from pathlib import Path
-from typing import List
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from pronto.aligning import AlignedVerse
-from pronto.tasks._util import train_dev_test_split
-from pronto.tasks.spec import TaskSpec
+from pronto.tasks._util import (
+    DEFAULT_SPLIT_RATIOS,
+    PAIR_COLUMNS,
+    PAIR_KEY_COLUMNS,
+    ExcludingSequence,
+    Pair,
+    PairRow,
+    concatenate_with_positions,
+    pair_rows,
+    pairs_per_instance,
+)
+from pronto.tasks.propositions import PropositionIndex, build_proposition_index
+from pronto.tasks.spec import StreamingTaskSpec, TaskSpec
+from pronto.tasks.writers import RowWriter
 
 logger = getLogger(__name__)
 
 
-def build_index(config, verses: List[AlignedVerse]):
-    # mapping from sense labels to verses which contain them
-    index = defaultdict(list)
+def build_index(
+    config, verses: List[AlignedVerse], proposition_index: Optional[PropositionIndex] = None
+) -> Dict[str, List[int]]:
+    # mapping from sense labels to indexes of verses which contain them
+    if proposition_index is None:
+        proposition_index = build_proposition_index(verses)
+    proposition_index.check(verses)
+    return proposition_index.senses(config.singleton_only, config.allow_duplicate_senses_in_verse)
 
-    for verse in verses:
-        sense_annotations = []
-        for sentence in verse.ontonotes_sentences:
-            for leaf in sentence.leaves:
-                if leaf.prop is not None:
-                    sense_annotations.append(leaf.prop)
 
-        # if we only want verses with a single sense annotation, bail out
-        if config.singleton_only and len(sense_annotations) != 1:
-            continue
-
-        if not config.allow_duplicate_senses_in_verse and len(set(s.label for s in sense_annotations)) != len(
-            sense_annotations
-        ):
-            continue
-
-        for sense in sense_annotations:
-            if verse not in index[sense.label]:
-                index[sense.label].append(verse)
-
-    return index
-
-
-def process_verses(
-    config,
-    verses,
-    output_dir,
-):
+def generate_pairs(config, index: Dict[str, List[int]]) -> Iterator[Pair]:
     random.seed(42)
-    index = build_index(config, verses)
-    outputs = []
+    all_sense_ids, positions = concatenate_with_positions(index.values())
 
-    for label, verses in index.items():
-        other_sense_keys = [x for x in index.keys() if x != label]
+    for label, ids in index.items():
         # All verses for other sense labels. Note that we also exclude verses which contain `label`.
-        other_sense_verses = [v for x in other_sense_keys for v in index[x] if v not in verses]
-        for i, verse in enumerate(verses):
+        other_sense_ids = ExcludingSequence(all_sense_ids, [p for v in ids for p in positions[v]])
+        for i, verse_id in enumerate(ids):
 
             def sample(vs, n, positive=True):
                 if len(vs) == 0:
@@ -65,41 +53,68 @@ def process_verses(
                 return random.sample(vs, n)
 
             # Candidates for same sense pairings: everything after this one (avoid duplicate combinations)
-            same_sense_verses = verses[i + 1 :]
-            positive_examples = sample(same_sense_verses, config.positive_pairs_per_instance)
+            same_sense_positions = range(i + 1, len(ids))
+            positive_examples = [ids[j] for j in sample(same_sense_positions, config.positive_pairs_per_instance)]
             negative_examples = sample(
-                other_sense_verses, min(config.negative_per_positive * len(positive_examples), len(positive_examples))
+                other_sense_ids, min(config.negative_per_positive * len(positive_examples), len(positive_examples))
             )
-            for verse2 in positive_examples:
-                outputs.append((label, verse.verse.body, verse2.verse.body, "same", verse.reference, verse2.reference))
-            for verse2 in negative_examples:
-                outputs.append(
-                    (label, verse.verse.body, verse2.verse.body, "different", verse.reference, verse2.reference)
-                )
+            for j in positive_examples:
+                yield label, verse_id, j, "same"
+            for j in negative_examples:
+                yield label, verse_id, j, "different"
 
-    for split, rows in zip(["train", "dev", "test"], train_dev_test_split(outputs)):
-        with open(Path(output_dir) / Path(f"same_sense_{split}.tsv"), "w") as f:
-            for sense, s1, s2, l, r1, r2 in rows:
-                f.write(f"{sense}\t{s1}\t{s2}\t{l}\t{r1}\t{r2}\n")
+
+def count_pairs(config, index: Dict[str, List[int]]) -> Dict[str, int]:
+    # how many pairs generate_pairs draws for each label
+    occurrences = Counter(v for ids in index.values() for v in ids)
+    total = sum(occurrences.values())
+    counts = {}
+    for label, ids in index.items():
+        others = total - sum(occurrences[v] for v in ids)
+        counts[label] = sum(pairs_per_instance(config, len(ids) - 1 - i, others) for i in range(len(ids)))
+    return counts
+
+
+def generate_rows(config, verses, proposition_index=None) -> Iterator[PairRow]:
+    index = build_index(config, verses, proposition_index)
+    counts = count_pairs(config, index) if config.pair_budget is not None else None
+    return pair_rows(generate_pairs(config, index), verses, counts, config.pair_budget)
 
 
 @TaskSpec.register("same_sense")
-class SameSense(TaskSpec):
+class SameSense(StreamingTaskSpec):
+    """
+    Pairs of verses which do or do not share a sense label. Pairs are written as they are drawn, to the split
+    given by a hash of their references (see `pronto.tasks._util.SplitAssigner`) in proportion to
+    `split_ratios`; `shuffle_split` restores the shuffled split of earlier versions. `pair_budget` caps the
+    number of pairs written (see `pronto.tasks._util.pair_rows`).
+    """
+
+    VERSION = "003"
+    RESOURCES = ("proposition_index",)
+    NAME = "same_sense"
+    COLUMNS = PAIR_COLUMNS
+    KEY_COLUMNS = PAIR_KEY_COLUMNS
+
     def __init__(
         self,
         singleton_only: bool = False,
         allow_duplicate_senses_in_verse: bool = True,
         negative_per_positive: int = 1,
         positive_pairs_per_instance: int = 1,
+        pair_budget: Optional[int] = None,
+        split_ratios: Tuple[float, float, float] = DEFAULT_SPLIT_RATIOS,
+        shuffle_split: bool = False,
+        writer: Optional[RowWriter] = None,
     ):
+        super().__init__(split_ratios, shuffle_split, writer)
         self.singleton_only = singleton_only
         self.allow_duplicate_senses_in_verse = allow_duplicate_senses_in_verse
         self.negative_per_positive = negative_per_positive
         self.positive_pairs_per_instance = positive_pairs_per_instance
+        self.pair_budget = pair_budget
 
-    def process(self, verses: List[AlignedVerse], output_dir: str) -> None:
-        process_verses(
-            self,
-            verses,
-            output_dir,
-        )
+    def rows(
+        self, verses: List[AlignedVerse], proposition_index: Optional[PropositionIndex] = None
+    ) -> Iterator[PairRow]:
+        return generate_rows(self, verses, proposition_index)
@@ -1,10 +1,102 @@
-from typing import List
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-from tango.common import Registrable
+from tango import Format
+from tango.common import PathOrStr, Registrable
+from tango.common.det_hash import DetHashWithVersion
 
 from pronto.aligning import AlignedVerse
+from pronto.tasks._util import DEFAULT_SPLIT_RATIOS
+from pronto.tasks.writers import RowWriter, write_task_rows
 
+# The files a task spec writes, by file name
+TaskData = Dict[str, bytes]
 
-class TaskSpec(Registrable):
-    def process(self, verses: List[AlignedVerse], output_dir: str) -> None:
+
+class TaskSpec(Registrable, DetHashWithVersion):
+    # Bump a spec's VERSION when its output changes. Together with the spec's parameters, it keys the cached
+    # output of `pronto.steps::run_task_spec`.
+    VERSION: Optional[str] = None
+
+    # Names of shared, precomputed inputs (e.g. "ud_parses") which `process` accepts as optional keyword
+    # arguments. Steps pass along whichever of these they were given; a spec must work without them.
+    RESOURCES: Tuple[str, ...] = ()
+
+    def process(self, verses: List[AlignedVerse], output_dir: str, **resources) -> Optional[Dict[str, int]]:
         raise NotImplemented()
+
+
+class StreamingTaskSpec(TaskSpec):
+    """
+    A task spec which yields its rows lazily from `rows`, and leaves writing them to `write_task_rows`: each
+    row goes to a `{NAME}_{split}` file as soon as it is yielded, and also to a `{NAME}` file of every row if
+    `WRITE_ALL` is set. Rows are split by the fields at `KEY_COLUMNS` (see `pronto.tasks._util.SplitAssigner`),
+    and written in the format of `writer`, TSV by default.
+
+    `process` returns how many rows went to each split.
+    """
+
+    NAME: str
+    COLUMNS: Tuple[str, ...]
+    KEY_COLUMNS: Tuple[int, ...] = (-1,)
+    WRITE_ALL: bool = False
+
+    def __init__(
+        self,
+        split_ratios: Tuple[float, float, float] = DEFAULT_SPLIT_RATIOS,
+        shuffle_split: bool = False,
+        writer: Optional[RowWriter] = None,
+    ):
+        self.split_ratios = split_ratios
+        self.shuffle_split = shuffle_split
+        self.writer = writer
+
+    def rows(self, verses: List[AlignedVerse], **resources) -> Iterator[Tuple]:
+        raise NotImplementedError()
+
+    def process(self, verses: List[AlignedVerse], output_dir: str, **resources) -> Dict[str, int]:
+        return write_task_rows(
+            self.rows(verses, **resources),
+            output_dir,
+            self.NAME,
+            self.COLUMNS,
+            self.KEY_COLUMNS,
+            self.writer,
+            self.split_ratios,
+            self.shuffle_split,
+            self.WRITE_ALL,
+        )
+
+
+def resources_for(spec: TaskSpec, resources: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in resources.items() if k in spec.RESOURCES and v is not None}
+
+
+def run_task_spec(spec: TaskSpec, verses: List[AlignedVerse], **resources) -> TaskData:
+    """
+    Run a spec in a scratch directory and return the files it wrote.
+    """
+    with TemporaryDirectory() as tmp:
+        spec.process(verses, tmp, **resources)
+        return {name: (Path(tmp) / name).read_bytes() for name in sorted(os.listdir(tmp))}
+
+
+@Format.register("pronto::task_data")
+class TaskDataFormat(Format[TaskData]):
+    """
+    Stores `TaskData` as the files themselves, so cached task outputs can be inspected directly.
+    """
+
+    VERSION = "001"
+
+    def write(self, artifact: TaskData, dir: PathOrStr):
+        files_dir = Path(dir) / "files"
+        files_dir.mkdir()
+        for name, contents in artifact.items():
+            (files_dir / name).write_bytes(contents)
+
+    def read(self, dir: PathOrStr) -> TaskData:
+        files_dir = Path(dir) / "files"
+        return {name: (files_dir / name).read_bytes() for name in sorted(os.listdir(files_dir))}
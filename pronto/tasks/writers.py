@@ -0,0 +1,136 @@
+import json
+from contextlib import ExitStack
+from pathlib import Path
+from typing import IO, Dict, Iterable, Sequence, Tuple
+
+from tango.common import Registrable
+
+from pronto.tasks._util import (
+    DEFAULT_SPLIT_RATIOS,
+    SPLITS,
+    SplitAssigner,
+    check_split_ratios,
+    train_dev_test_split,
+)
+
+_TSV_SEPARATORS = str.maketrans({"\t": " ", "\n": " ", "\r": " "})
+
+
+def format_tsv_field(value) -> str:
+    """
+    Format a value as a TSV field. Tabs and line breaks, the only characters which would break up a row, are
+    replaced by spaces, as `pronto.scripts.usfx_to_tsv` does for verse text; everything else is written as is,
+    so readers need no unescaping.
+    """
+    return str(value).translate(_TSV_SEPARATORS)
+
+
+class RowSink:
+    """
+    Writes formatted rows to a file, buffering up to `buffer_rows` of them between writes.
+    """
+
+    def __init__(self, f: IO[str], writer: "RowWriter", columns: Sequence[str]):
+        self.f = f
+        self.writer = writer
+        self.columns = columns
+        self.count = 0
+        self._buffer = []
+
+    def write(self, row: Tuple) -> None:
+        self._buffer.append(self.writer.format_row(row, self.columns))
+        self.count += 1
+        if len(self._buffer) >= self.writer.buffer_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        self.f.write("".join(self._buffer))
+        self._buffer.clear()
+
+
+class RowWriter(Registrable):
+    """
+    An output format for task rows. `open` returns a `RowSink` for `{path}{EXTENSION}`.
+    """
+
+    default_implementation = "tsv"
+    EXTENSION: str = ""
+
+    def __init__(self, buffer_rows: int = 256):
+        self.buffer_rows = buffer_rows
+
+    def format_row(self, row: Tuple, columns: Sequence[str]) -> str:
+        raise NotImplementedError()
+
+    def open(self, stack: ExitStack, path: Path, columns: Sequence[str]) -> RowSink:
+        f = stack.enter_context(open(f"{path}{self.EXTENSION}", "w"))
+        sink = RowSink(f, self, columns)
+        # flush before the file is closed
+        stack.callback(sink.flush)
+        return sink
+
+
+@RowWriter.register("tsv")
+class TsvWriter(RowWriter):
+    """
+    One tab-separated line per row, without a header, with fields formatted by `format_tsv_field`.
+    """
+
+    EXTENSION = ".tsv"
+
+    def format_row(self, row: Tuple, columns: Sequence[str]) -> str:
+        return "\t".join(map(format_tsv_field, row)) + "\n"
+
+
+@RowWriter.register("jsonl")
+class JsonlWriter(RowWriter):
+    """
+    One JSON object per row, keyed by the spec's column names.
+    """
+
+    EXTENSION = ".jsonl"
+
+    def format_row(self, row: Tuple, columns: Sequence[str]) -> str:
+        return json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n"
+
+
+def write_task_rows(
+    rows: Iterable[Tuple],
+    output_dir: str,
+    name: str,
+    columns: Sequence[str],
+    key_columns: Sequence[int] = (-1,),
+    writer: RowWriter = None,
+    split_ratios: Tuple[float, float, float] = DEFAULT_SPLIT_RATIOS,
+    shuffle_split: bool = False,
+    write_all: bool = False,
+) -> Dict[str, int]:
+    """
+    Write rows to `{name}_{split}` files in `output_dir`, and to a `{name}` file of every row if `write_all`.
+    Returns how many rows went to each split.
+
+    By default each row goes to the split `SplitAssigner` gives the fields at `key_columns` (joined by tabs),
+    as soon as it is read, so `rows` may be a generator of any length. With `shuffle_split`, rows are instead
+    collected and split by `train_dev_test_split`.
+    """
+    # checked before any file is opened, in either mode
+    check_split_ratios(split_ratios)
+    writer = writer if writer is not None else TsvWriter()
+    with ExitStack() as stack:
+        all_rows = writer.open(stack, Path(output_dir) / name, columns) if write_all else None
+        sinks = [writer.open(stack, Path(output_dir) / f"{name}_{split}", columns) for split in SPLITS]
+        if shuffle_split:
+            rows = list(rows)
+            if all_rows is not None:
+                for row in rows:
+                    all_rows.write(row)
+            for sink, split_rows in zip(sinks, train_dev_test_split(rows, split_ratios)):
+                for row in split_rows:
+                    sink.write(row)
+        else:
+            assign = SplitAssigner(split_ratios)
+            for row in rows:
+                if all_rows is not None:
+                    all_rows.write(row)
+                sinks[assign("\t".join(str(row[i]) for i in key_columns))].write(row)
+    return {split: sink.count for split, sink in zip(SPLITS, sinks)}
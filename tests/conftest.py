@@ -0,0 +1,131 @@
+"""
+Small synthetic OntoNotes, Bible and USFX inputs, shaped like the real ones, for checking that the faster
+implementations of each pipeline stage agree with the ones they replaced.
+"""
+
+import random
+
+import pytest
+from onf_parser.models import Coref, Leaf, PlainSentence, Prop, PropArg, Section, Sentence, SpeakerInformation, Tree
+
+BOOKS = ["Matthew", "Mark", "1_Corinthians", "Romans", "Acts"]
+BIBLE_BOOKS = {"MAT": 6, "MRK": 6, "1CO": 6, "ROM": 6, "ACT": 4, "LUK": 6}
+NOUNS = ["man", "house", "word", "servant", "bread"]
+NAMES = ["Jesus", "Peter", "Paul", "John"]
+PRONOUNS = ["he", "him", "they", "it", "we"]
+SENSES = ["say.01", "go.02", "give.01", "see.01", "come.01", "make.01"]
+ARGS = ["ARG0", "ARG1", "ARG2", "ARGM-TMP", "ARGM-LOC", "LINK-SLC", "v"]
+MOODS = ["S", "S", "S", "S-IMP", "SQ", "SBARQ", "FRAG", "S-CLF", "NP"]
+
+
+def _tree(rng):
+    subject = rng.choice(
+        [
+            f"(NP-SBJ (NNP {rng.choice(NAMES)}))",
+            f"(NP-SBJ (DT the) (NN {rng.choice(NOUNS)}))",
+            "(NP-SBJ (-NONE- *PRO*))",
+            f"(NP-SBJ (PRP {rng.choice(PRONOUNS)}))",
+        ]
+    )
+    inner = f" (SBAR (IN that) (S (NP-SBJ (NNP {rng.choice(NAMES)})) (VP (VBD went))))" if rng.random() < 0.3 else ""
+    vp = f"(VP (VBD said) (NP (DT the) (NNS {rng.choice(NOUNS)}s)){inner})"
+    return f"(TOP ({rng.choice(MOODS)} {subject} {vp} (. .)))"
+
+
+def _sentence(rng, book, start, stop):
+    leaves = []
+    for i in range(rng.randint(3, 8)):
+        leaf = Leaf(i, rng.choice(NOUNS + NAMES + PRONOUNS))
+        if rng.random() < 0.25:
+            args = {a: [PropArg(0, 0, ["x"])] for a in rng.sample(ARGS, rng.randint(1, 5))}
+            leaf.prop = Prop(rng.choice(SENSES), args)
+        if rng.random() < 0.3:
+            tokens = rng.choice([[rng.choice(PRONOUNS)], [rng.choice(NAMES)], ["the", rng.choice(NOUNS)], ["Him"]])
+            leaf.coref = Coref("IDENT", str(rng.randint(1, 50)), (0, len(tokens) - 1), tokens)
+        leaves.append(leaf)
+    return Sentence(PlainSentence("x"), None, SpeakerInformation(book, start, stop), Tree(_tree(rng)), leaves)
+
+
+@pytest.fixture(scope="session")
+def ontonotes_data():
+    """
+    Output shaped like `pronto.steps::read_ontonotes`: five books of five chapters, with some sentences that
+    span two verses, some verses with two sentences, and a sentence in each chapter with no speaker information.
+    """
+    rng = random.Random(0)
+    data = []
+    for book in BOOKS:
+        sections = []
+        for chapter in range(1, 6):
+            sentences = []
+            verse = 1
+            while verse <= 25:
+                r = rng.random()
+                if r < 0.15:
+                    sentences.append(_sentence(rng, book, f"{chapter}_{verse}_0", f"{chapter}_{verse + 1}_0"))
+                    verse += 2
+                else:
+                    for _ in range(2 if r < 0.3 else 1):
+                        sentences.append(_sentence(rng, book, f"{chapter}_{verse}_0", f"{chapter}_{verse}_0"))
+                    verse += 1
+            sentences.append(
+                Sentence(PlainSentence("x"), None, None, Tree("(TOP (S (NP-SBJ (NNP X)) (VP (VB y))))"), [])
+            )
+            sections.append(Section(sentences, None))
+        data.append((f"{book}.onf", sections))
+    return data
+
+
+@pytest.fixture(scope="session")
+def bible_path(tmp_path_factory):
+    """
+    A Bible TSV with a book OntoNotes lacks, missing and empty verses, non-integer verse ids, and an unknown
+    book code.
+    """
+    rng = random.Random(1)
+    path = tmp_path_factory.mktemp("bible") / "bible.tsv"
+    with open(path, "w") as f:
+        for code, chapters in BIBLE_BOOKS.items():
+            for c in range(1, chapters + 1):
+                for v in range(1, 27):
+                    r = rng.random()
+                    if r < 0.03:
+                        continue
+                    elif r < 0.04:
+                        f.write(f"{code}\t{c}\t{v}a\tpartial\n")
+                    elif r < 0.05:
+                        f.write(f"{code}\t{c}\t{v}\t  \n")
+                    else:
+                        words = " ".join(rng.choice(["el", "hombre", "dijo", "casa", "pan"]) for _ in range(8))
+                        f.write(f"{code}\t{c}\t{v}\t{words} {code}{c}:{v}\n")
+        f.write("XYZ\t1\t1\tunknown book\n")
+    return str(path)
+
+
+@pytest.fixture(scope="session")
+def aligned_verses(ontonotes_data, bible_path):
+    from pronto.aligning import align_verses_to_index, index_ontonotes
+    from pronto.reading import read_bible_tsv
+
+    return align_verses_to_index(index_ontonotes(ontonotes_data), read_bible_tsv(bible_path), threshold=0)
+
+
+@pytest.fixture(scope="session")
+def usfx_path(tmp_path_factory):
+    path = tmp_path_factory.mktemp("usfx") / "synthetic_usfx.xml"
+    with open(path, "w") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<usfx>\n')
+        for b in range(3):
+            f.write(f'<book id="B{b:02d}"><h>Book {b}</h>\n')
+            for c in range(1, 4):
+                f.write(f'<c id="{c}" /><cl>Chapter {c}</cl>\n<p>')
+                for v in range(1, 6):
+                    f.write(
+                        f'<v id="{v}" />In the <w s="G{v}">beginning</w> was the word'
+                        f'<f caller="+"><fr>{c}:{v} </fr><ft>Or, "the account"</ft></f>, '
+                        f'and <ref tgt="B{b:02d}.{c}.{v}">the word</ref> was with God.<ve />\n'
+                    )
+                f.write("</p>\n")
+            f.write("</book>\n")
+        f.write("</usfx>\n")
+    return str(path)
@@ -0,0 +1,70 @@
+import json
+from collections import defaultdict
+
+from pronto.aligning import AlignedVerse, align_verses_to_index_with_stats, index_ontonotes
+from pronto.consts import BOOKS_S2L, ONTONOTES_BLACKLIST
+from pronto.ontonotes_index import parse_ontonotes_speaker_info
+from pronto.reading import read_bible_tsv
+
+
+def nested_dict_align_verses_to_index(ontonotes_verse_index, bible_data):
+    """
+    The nested-dict aligner that `align_verses_to_index` replaced, without its logging.
+    """
+    bible_verse_index = defaultdict(lambda: defaultdict(dict))
+    for book in bible_data:
+        book_id = BOOKS_S2L[book.id] if book.id in BOOKS_S2L else book.id
+        for chapter in book.chapters:
+            for verse in chapter.verses:
+                if (book_id, chapter.id, verse.id) not in ONTONOTES_BLACKLIST:
+                    bible_verse_index[book_id][chapter.id][verse.id] = verse
+
+    common_books = set(bible_verse_index.keys()).intersection(set(ontonotes_verse_index.keys()))
+    aligned = []
+    for book in common_books:
+        for chapter in ontonotes_verse_index[book].keys():
+            for verse_id, sentence_ids in ontonotes_verse_index[book][chapter].items():
+                if chapter in bible_verse_index[book] and verse_id in bible_verse_index[book][chapter]:
+                    verse = bible_verse_index[book][chapter][verse_id]
+                    sentences = ontonotes_verse_index.sentences(sentence_ids)
+                    aligned.append(AlignedVerse(book, chapter, verse_id, verse, sentences))
+    return aligned
+
+
+def test_aligner_matches_nested_dict_aligner(ontonotes_data, bible_path):
+    index = index_ontonotes(ontonotes_data)
+    bible_data = read_bible_tsv(bible_path)
+    aligned, stats = align_verses_to_index_with_stats(index, bible_data, threshold=0)
+    assert aligned == nested_dict_align_verses_to_index(index, bible_data)
+    assert stats.aligned == len(aligned) > 0
+
+
+def test_aligned_verse_attributes_match_recomputed_ones(aligned_verses):
+    for v in aligned_verses:
+        is_cross_verse = False
+        for sentence in v.ontonotes_sentences:
+            _, start, stop = parse_ontonotes_speaker_info(sentence.speaker_information)
+            if any(int(verse) != v.verse_id for _, verse, _ in start + stop):
+                is_cross_verse = True
+        assert v.is_cross_verse == is_cross_verse
+        assert v.mentions == [l.coref for s in v.ontonotes_sentences for l in s.leaves if l.coref is not None]
+        assert v.sense_annotations == [l.prop for s in v.ontonotes_sentences for l in s.leaves if l.prop is not None]
+        assert v.reference == f"{v.book} {v.chapter}:{v.verse_id}"
+    assert any(v.is_cross_verse for v in aligned_verses)
+
+
+def test_manifest_reuses_unchanged_books_and_lists_changed_verses(ontonotes_data, bible_path, tmp_path):
+    index = index_ontonotes(ontonotes_data)
+    manifest_path = str(tmp_path / "manifest.json")
+    expected, _ = align_verses_to_index_with_stats(index, read_bible_tsv(bible_path), threshold=0)
+    first, stats = align_verses_to_index_with_stats(index, read_bible_tsv(bible_path), 0, manifest_path)
+    assert first == expected and stats.reused_books == []
+
+    bible_data = read_bible_tsv(bible_path)
+    edited = bible_data[0].chapters[0].verses[0]
+    edited.body = "an edited verse"
+    second, stats = align_verses_to_index_with_stats(index, bible_data, 0, manifest_path)
+    assert second == align_verses_to_index_with_stats(index, bible_data, threshold=0)[0]
+    assert sorted(stats.reused_books) == ["1 Corinthians", "Acts", "Mark", "Romans"]
+    with open(manifest_path) as f:
+        assert json.load(f)["changed"] == [f"Matthew 1:{edited.id}"]
@@ -0,0 +1,76 @@
+import logging
+from collections import defaultdict
+
+from pronto.consts import BOOKS_S2L
+from pronto.reading import Book, Chapter, Verse, read_bible_tsv
+
+
+def nested_dict_read_bible_tsv(path):
+    """
+    The reader that `read_bible_tsv` replaced, which built nested dicts and sorted each level.
+    """
+    logger = logging.getLogger("pronto.reading")
+    books = defaultdict(lambda: defaultdict(lambda: dict()))
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                pieces = line.split("\t")
+                book_id = pieces[0]
+                chapter_id = int(pieces[1])
+                try:
+                    verse_id = int(pieces[2])
+                except ValueError:
+                    logger.warning(f"{book_id} {chapter_id}: found non-integer verse {pieces[2]}. Skipping.")
+                    continue
+                body = pieces[3]
+                if body.strip() == "":
+                    logger.warning(f"{book_id} {chapter_id}: verse {pieces[2]} is empty. Skipping.")
+                    continue
+                books[book_id][chapter_id][verse_id] = body.strip()
+            except Exception as e:
+                logger.error(f"Error encountered while handling a line: {line} ({pieces})")
+                logger.exception(e)
+
+    for book_id in books:
+        if book_id not in BOOKS_S2L:
+            logger.warning(f"Unknown bookcode: {book_id}")
+
+    return [
+        Book(
+            book_id,
+            [
+                Chapter(chapter_id, [Verse(verse_id, verse) for verse_id, verse in sorted(verses.items())])
+                for chapter_id, verses in sorted(books[book_id].items())
+            ],
+        )
+        for book_id in BOOKS_S2L.keys()
+        if book_id in books
+    ]
+
+
+def test_reader_matches_nested_dict_reader(bible_path, tmp_path, caplog):
+    path = tmp_path / "bible.tsv"
+    with open(bible_path) as f, open(path, "w") as out:
+        out.write(f.read())
+        # out of order, repeated, and malformed lines
+        out.write("MAT\t1\t2\tA later line for a verse replaces the earlier one.\nMRK\t1\t0\tVerse zero.\n")
+        out.write("not a verse\nMAT\tx\t1\tbad chapter\nABC\t1\t1\tanother unknown book\n")
+
+    with caplog.at_level(logging.INFO, logger="pronto.reading"):
+        expected = nested_dict_read_bible_tsv(path)
+        expected_log = [(r.levelname, r.getMessage()) for r in caplog.records]
+        caplog.clear()
+        actual = read_bible_tsv(path)
+        actual_log = [(r.levelname, r.getMessage()) for r in caplog.records if not r.getMessage().startswith("Reading")]
+    assert actual == expected
+    assert actual_log == expected_log
+
+
+def test_indexes_match_chapter_and_verse_lists(bible_path):
+    bible = read_bible_tsv(bible_path)
+    assert [b.id for b in bible] == ["MAT", "MRK", "LUK", "ACT", "ROM", "1CO"]
+    for book in bible:
+        assert list(book.indexed_chapters.values()) == book.chapters
+        for chapter in book.chapters:
+            assert list(chapter.indexed_verses.values()) == chapter.verses
+            assert all(isinstance(v.id, int) and v.body.strip() != "" for v in chapter.verses)
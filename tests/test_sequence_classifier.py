@@ -0,0 +1,54 @@
+import datasets
+from transformers import (
+    BertConfig,
+    BertForSequenceClassification,
+    BertTokenizerFast,
+    DataCollatorWithPadding,
+    TrainingArguments,
+)
+
+from pronto.eval.sequence_classifier import _PaddingCountingTrainer
+
+WORDS = ["in", "the", "beginning", "was", "word", "and", "with", "god"]
+
+
+def test_padding_counts_cover_every_pass(tmp_path):
+    vocab_path = tmp_path / "vocab.txt"
+    vocab_path.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + WORDS) + "\n")
+    tokenizer = BertTokenizerFast(vocab_file=str(vocab_path))
+    config = BertConfig(
+        vocab_size=len(WORDS) + 5, hidden_size=8, num_hidden_layers=1, num_attention_heads=1, intermediate_size=8
+    )
+    texts = [" ".join(WORDS[: 1 + i % len(WORDS)]) for i in range(20)]
+    splits = {
+        split: datasets.Dataset.from_dict({"text": texts, "label": [i % 2 for i in range(len(texts))]}).map(
+            lambda x: tokenizer(x["text"]), batched=True, remove_columns=["text"]
+        )
+        for split in ["train", "dev", "test"]
+    }
+    epochs = 2
+    trainer = _PaddingCountingTrainer(
+        model=BertForSequenceClassification(config),
+        args=TrainingArguments(
+            output_dir=str(tmp_path / "out"),
+            num_train_epochs=epochs,
+            per_device_train_batch_size=4,
+            per_device_eval_batch_size=4,
+            evaluation_strategy="epoch",
+            save_strategy="no",
+            report_to=[],
+        ),
+        train_dataset=splits["train"],
+        eval_dataset=splits["dev"],
+        tokenizer=tokenizer,
+        data_collator=DataCollatorWithPadding(tokenizer=tokenizer, return_tensors="pt"),
+    )
+    trainer.train()
+    trainer.predict(splits["test"])
+
+    # one pass over train per epoch, one over dev per evaluation, and one over test
+    passes = {"train": epochs, "dev": epochs, "test": 1}
+    for split, counter in trainer.padding.items():
+        stats = counter.take()
+        assert stats["real_tokens"] == passes[split] * sum(len(x) for x in splits[split]["input_ids"])
+        assert stats["padded_tokens"] > stats["real_tokens"] and 0 < stats["waste"] < 1
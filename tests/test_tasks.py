@@ -0,0 +1,41 @@
+import filecmp
+import os
+
+from pronto.tasks import same_sense
+from pronto.tasks._util import ExcludingSequence, concatenate_with_positions
+from pronto.tasks.features import build_verse_features
+from pronto.tasks.nonpronominal_mention import NonpronominalMention
+from pronto.tasks.proper_noun_subject import ProperNounSubject
+from pronto.tasks.propositions import build_proposition_index
+from pronto.tasks.sentence_mood import SentenceMood
+
+
+def test_negative_pools_match_filtered_lists(aligned_verses):
+    index = same_sense.build_index(same_sense.SameSense(), aligned_verses, build_proposition_index(aligned_verses))
+    flat, positions = concatenate_with_positions(index.values())
+    for label, ids in index.items():
+        pool = ExcludingSequence(flat, [p for v in ids for p in positions[v]])
+        assert list(pool) == [v for x in index if x != label for v in index[x] if v not in ids]
+
+
+def test_shared_verse_features_write_same_task_data(aligned_verses, tmp_path):
+    specs = [NonpronominalMention(), ProperNounSubject(), SentenceMood()]
+    os.makedirs(tmp_path / "per_spec")
+    os.makedirs(tmp_path / "shared")
+    features = build_verse_features(aligned_verses)
+    for spec in specs:
+        spec.process(aligned_verses, tmp_path / "per_spec")
+        spec.process(aligned_verses, tmp_path / "shared", verse_features=features)
+    names = sorted(os.listdir(tmp_path / "per_spec"))
+    assert names == sorted(os.listdir(tmp_path / "shared"))
+    _, mismatched, errors = filecmp.cmpfiles(tmp_path / "per_spec", tmp_path / "shared", names, shallow=False)
+    assert len(names) >= 3 * len(specs) and mismatched == errors == []
+
+
+def test_specs_without_subject_column_skip_subject_yields(aligned_verses, tmp_path, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("subject yields computed")
+
+    monkeypatch.setattr("pronto.tasks.features.token_yield_of_tree_node", fail)
+    for spec in [NonpronominalMention(), SentenceMood()]:
+        spec.process(aligned_verses, tmp_path)
@@ -0,0 +1,69 @@
+import nltk
+import pytest
+
+from pronto.tasks._util import token_yield_of_tree_node, token_yields_of_tree_node
+
+TARGETS = ["NP-SBJ", "NP", "VP", "S", "PP"]
+
+
+def recursive_token_yield_of_tree_node(tree, target, blockers={"S": 1}):
+    """
+    The recursive implementation that `token_yield_of_tree_node` replaced.
+    """
+    token_num = 0
+    in_target = False
+    token_yield = []
+    blocker_tracker = {b: 0 for b in blockers.keys()}
+
+    def dfs(node, ancestors=()):
+        nonlocal token_num, in_target
+        if type(node) is str:
+            if in_target:
+                token_yield.append((token_num, ancestors))
+            token_num += 1
+        elif type(node) == nltk.tree.Tree:
+            node_type = node.label()
+            node_supertype = node_type.split("-")[0]
+
+            blocker_match = None
+            for b in blockers.keys():
+                if node_supertype.startswith(b):
+                    blocker_match = b
+
+            if is_blocker := blocker_match is not None:
+                blocker_tracker[blocker_match] += 1
+            if is_target := target in node_type:
+                if all(blocker_tracker[b] <= blockers[b] for b in blockers.keys()):
+                    in_target = True
+
+            for x in node:
+                dfs(x, ancestors + (node_type,))
+
+            if is_blocker:
+                blocker_tracker[blocker_match] -= 1
+            if is_target:
+                in_target = False
+
+    dfs(tree)
+    return token_yield
+
+
+@pytest.fixture(scope="module")
+def trees(ontonotes_data):
+    return [
+        sentence.tree.parsed_tree
+        for _, sections in ontonotes_data
+        for section in sections
+        for sentence in section.sentences
+        if sentence.tree is not None
+    ]
+
+
+@pytest.mark.parametrize("blockers", [{"S": 1}, {}, {"NP": 1}, {"S": 0, "SBAR": 1}, {"V": 1, "VP": 2}])
+def test_token_yields_match_recursive_implementation(trees, blockers):
+    for tree in trees:
+        combined = token_yields_of_tree_node(tree, TARGETS, blockers)
+        for target in TARGETS:
+            expected = recursive_token_yield_of_tree_node(tree, target, blockers)
+            assert token_yield_of_tree_node(tree, target, blockers) == expected
+            assert combined[target] == expected
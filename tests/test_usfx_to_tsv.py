@@ -0,0 +1,13 @@
+import filecmp
+
+from pronto.scripts.usfx_to_tsv import convert_dom, convert_streaming
+
+
+def test_streaming_converter_matches_dom_converter(usfx_path, tmp_path):
+    convert_dom(usfx_path, tmp_path / "dom.tsv")
+    convert_streaming(usfx_path, tmp_path / "streaming.tsv")
+    assert filecmp.cmp(tmp_path / "dom.tsv", tmp_path / "streaming.tsv", shallow=False)
+    with open(tmp_path / "streaming.tsv") as f:
+        rows = [line.rstrip("\n").split("\t") for line in f]
+    assert len(rows) == 3 * 3 * 5
+    assert rows[0] == ["B00", "1", "1", "In the beginning was the word , and was with God."]
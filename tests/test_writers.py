@@ -0,0 +1,14 @@
+from pronto.eval.sequence_classifier import construct_dataset_dict
+from pronto.tasks.writers import write_task_rows
+
+
+def test_tsv_rows_read_back_by_sequence_classifier(tmp_path):
+    texts = [f"verse {i} with a \\ backslash, \\t and a \\n as written" for i in range(30)]
+    texts[0] = "a verse\twith a tab and\r\na line break"
+    rows = [(text, i % 2, f"Mark 1:{i}") for i, text in enumerate(texts)]
+    counts = write_task_rows(rows, str(tmp_path), "task", ("text", "label", "reference"))
+    assert sum(counts.values()) == len(rows)
+
+    dataset_dict = construct_dataset_dict(str(tmp_path / "task"), True, 2, 0, 1, None, None)
+    read = sorted(x for split in ["train", "dev", "test"] for x in dataset_dict[split]["text"])
+    assert read == sorted(["a verse with a tab and  a line break"] + texts[1:])